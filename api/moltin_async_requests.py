@@ -0,0 +1,167 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api import moltin_requests
+from api.moltin_requests import DEFAULT_POOL_SIZE
+
+
+class AsyncMoltinClient:
+    """Asyncio counterpart of MoltinClient.
+
+    Requests are made by blocking functions of `moltin_requests` on a pool
+    of `pool_size` threads, so they go through the shared MoltinClient:
+    its base url, pooled session, re-authentication on 401 status and
+    `resilient_request` retries and circuit breakers. Coroutines awaiting
+    them overlap, i.e. gathered ones.
+
+    Coroutines of synchronous callers, i.e. bot handlers, are run by `run`
+    on the event loop of the client, which is started in a daemon thread
+    on first use.
+
+    Args:
+        pool_size: number of requests made simultaneously
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix='moltin_async',
+        )
+        self._loop = None
+        self._lock = threading.Lock()
+
+    async def call(self, function, *args, **kwargs):
+        """Call blocking function without blocking the event loop
+
+        Args:
+            function: blocking function, i.e. one of `moltin_requests`
+            args: positional arguments of function
+            kwargs: keyword arguments of function
+
+        Returns:
+            result of function
+        """
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(function, *args, **kwargs),
+        )
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name='moltin_async_loop',
+                    daemon=True,
+                ).start()
+
+            return self._loop
+
+    def run(self, coroutine):
+        """Run coroutine on the event loop of the client and wait for it
+
+        Must not be called from the event loop of the client.
+
+        Args:
+            coroutine: coroutine to run
+
+        Returns:
+            result of coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(
+            coroutine,
+            self._get_loop(),
+        ).result()
+
+    def close(self):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+
+        self._executor.shutdown(wait=False)
+
+
+_client = AsyncMoltinClient()
+
+
+def get_client():
+    """Get async Moltin client shared inside the process
+
+    Returns:
+        shared AsyncMoltinClient instance
+    """
+    return _client
+
+
+def configure_client(**client_params):
+    """Replace shared async Moltin client with a newly configured one
+
+    Args:
+        client_params: AsyncMoltinClient parameters
+
+    Returns:
+        shared AsyncMoltinClient instance
+    """
+    global _client
+
+    _client.close()
+    _client = AsyncMoltinClient(**client_params)
+
+    return _client
+
+
+def run_coroutine(coroutine):
+    """Run coroutine on the shared client, see `AsyncMoltinClient.run`"""
+    return _client.run(coroutine)
+
+
+def make_async(function):
+    """Make coroutine function calling blocking one on the shared client
+
+    Args:
+        function: blocking function, i.e. one of `moltin_requests`
+
+    Returns:
+        coroutine function with the same signature and docstring
+    """
+
+    @functools.wraps(function)
+    async def call(*args, **kwargs):
+        return await _client.call(function, *args, **kwargs)
+
+    return call
+
+
+fetch_auth_token = make_async(moltin_requests.fetch_auth_token)
+upload_product = make_async(moltin_requests.upload_product)
+update_product = make_async(moltin_requests.update_product)
+upload_image = make_async(moltin_requests.upload_image)
+create_product_image_relation = make_async(
+    moltin_requests.create_product_image_relation
+)
+create_flow = make_async(moltin_requests.create_flow)
+create_flow_field = make_async(moltin_requests.create_flow_field)
+upload_entry = make_async(moltin_requests.upload_entry)
+fetch_entries = make_async(moltin_requests.fetch_entries)
+fetch_all_entries = make_async(moltin_requests.fetch_all_entries)
+fetch_products = make_async(moltin_requests.fetch_products)
+fetch_all_products = make_async(moltin_requests.fetch_all_products)
+fetch_products_by_category_id = make_async(
+    moltin_requests.fetch_products_by_category_id
+)
+fetch_categories = make_async(moltin_requests.fetch_categories)
+fetch_product_by_id = make_async(moltin_requests.fetch_product_by_id)
+fetch_image_by_id = make_async(moltin_requests.fetch_image_by_id)
+add_product_to_cart = make_async(moltin_requests.add_product_to_cart)
+fetch_cart_items = make_async(moltin_requests.fetch_cart_items)
+remove_cart_item_by_id = make_async(moltin_requests.remove_cart_item_by_id)
+create_customer = make_async(moltin_requests.create_customer)
+
@@ -1,17 +1,149 @@
 import json
 
 import requests
+from requests.adapters import HTTPAdapter
 from slugify import slugify
 
+from api.resilience import resilient_request
 from helpers.tg_items_formatters import format_product
 
 API_ROOT = 'https://api.moltin.com'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (3.05, 10)
 
 
 class EntityExistsError(requests.models.HTTPError):
     pass
 
 
+class MoltinClient:
+    """Keep-alive HTTP client shared by all Moltin API calls.
+
+    Args:
+        api_root: base url of Moltin API
+        pool_size: number of pooled connections kept open to API host
+        timeout: default (connect, read) timeout of every request
+        token_provider: object refreshing token rejected with 401 status
+            via `force_refresh(stale_token)` method, i.e. AuthToken
+    """
+
+    def __init__(
+        self,
+        api_root=API_ROOT,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        token_provider=None,
+    ):
+        self.api_root = api_root
+        self.timeout = timeout
+        self.token_provider = token_provider
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @staticmethod
+    def build_headers(token=None, content_type=None):
+        """Build request headers
+
+        Args:
+            token: authorization token
+            content_type: value of Content-Type header if any
+
+        Returns:
+            dictionary of request headers
+        """
+        headers = {}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        return headers
+
+    def request(
+        self,
+        method,
+        path,
+        token=None,
+        content_type=None,
+        timeout=None,
+        **kwargs,
+    ):
+        """Make a request to Moltin API through pooled session
+
+        Request is guarded by endpoint circuit breaker and retried if it's
+        idempotent, see `resilient_request`. Request rejected with 401
+        status is retried once with token refreshed by token provider.
+
+        Args:
+            method: HTTP method
+            path: API path relative to API root
+            token: authorization token
+            content_type: value of Content-Type header if any
+            timeout: timeout overriding client default one
+            kwargs: other arguments passed to requests
+
+        Returns:
+            API response
+        """
+        response = resilient_request(
+            self.session,
+            method,
+            f'{self.api_root}{path}',
+            headers=self.build_headers(token, content_type),
+            timeout=timeout or self.timeout,
+            **kwargs,
+        )
+
+        if response.status_code != 401 or not (token and self.token_provider):
+            return response
+
+        fresh_token = self.token_provider.force_refresh(token)
+
+        return resilient_request(
+            self.session,
+            method,
+            f'{self.api_root}{path}',
+            headers=self.build_headers(fresh_token, content_type),
+            timeout=timeout or self.timeout,
+            **kwargs,
+        )
+
+    def close(self):
+        self.session.close()
+
+
+_client = MoltinClient()
+
+
+def get_client():
+    """Get Moltin client shared inside the process
+
+    Returns:
+        shared MoltinClient instance
+    """
+    return _client
+
+
+def configure_client(**client_params):
+    """Replace shared Moltin client with a newly configured one
+
+    Args:
+        client_params: MoltinClient parameters
+
+    Returns:
+        shared MoltinClient instance
+    """
+    global _client
+
+    _client.close()
+    _client = MoltinClient(**client_params)
+
+    return _client
+
+
 def fetch_auth_token(client_id, client_secret):
     """Make an API request to fetch bearer token
 
@@ -28,7 +160,7 @@ def fetch_auth_token(client_id, client_secret):
         'grant_type': 'client_credentials',
     }
 
-    response = requests.post(f'{API_ROOT}/oauth/access_token', data=data)
+    response = _client.request('POST', '/oauth/access_token', data=data)
     response.raise_for_status()
 
     return response.json()
@@ -44,16 +176,13 @@ def upload_product(token, product_details):
     Returns:
         API response containing uploaded product
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = format_product(product_details)
 
-    response = requests.post(
-        f'{API_ROOT}/v2/products',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        '/v2/products',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
 
@@ -64,6 +193,32 @@ def upload_product(token, product_details):
     return response.json()
 
 
+def update_product(token, product_id, product_details):
+    """Make an API request to update product
+
+    Args:
+        token: authorization token
+        product_id: id of product to update
+        product_details: new details of product
+
+    Returns:
+        API response containing updated product
+    """
+    data = format_product(product_details)
+    data['data']['id'] = product_id
+
+    response = _client.request(
+        'PUT',
+        f'/v2/products/{product_id}',
+        token=token,
+        content_type='application/json',
+        data=json.dumps(data),
+    )
+    response.raise_for_status()
+
+    return response.json()
+
+
 def upload_image(token, image_url):
     """Upload image to elasticpath account via API
 
@@ -77,17 +232,9 @@ def upload_image(token, image_url):
     Returns:
         API response containing uploaded image
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-    }
-
     files = {'file_location': (None, image_url)}
 
-    response = requests.post(
-        f'{API_ROOT}/v2/files',
-        headers=headers,
-        files=files,
-    )
+    response = _client.request('POST', '/v2/files', token=token, files=files)
 
     if response.status_code == 409:
         raise EntityExistsError
@@ -107,11 +254,6 @@ def create_product_image_relation(token, product_id, image_id):
     Returns:
         API response containing created relation
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = {
         'data': {
             'type': 'main_image',
@@ -119,9 +261,11 @@ def create_product_image_relation(token, product_id, image_id):
         },
     }
 
-    response = requests.post(
-        f'{API_ROOT}/v2/products/{product_id}/relationships/main-image',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        f'/v2/products/{product_id}/relationships/main-image',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
     response.raise_for_status()
@@ -140,11 +284,6 @@ def create_flow(token, name, description):
     Returns:
         API response containing created flow
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = {
         "data": {
             "type": "flow",
@@ -155,9 +294,11 @@ def create_flow(token, name, description):
         }
     }
 
-    response = requests.post(
-        f'{API_ROOT}/v2/flows',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        '/v2/flows',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
     response.raise_for_status()
@@ -178,11 +319,6 @@ def create_flow_field(token, name, description, field_type, flow_id):
     Returns:
         API response containing created flow field
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = {
         'data': {
             'type': 'field',
@@ -203,9 +339,11 @@ def create_flow_field(token, name, description, field_type, flow_id):
         }
     }
 
-    response = requests.post(
-        f'{API_ROOT}/v2/fields',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        '/v2/fields',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
     response.raise_for_status()
@@ -225,11 +363,6 @@ def upload_entry(token, flow_data, flow_slug):
         API response containing uploaded entry
     """
 
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = {
         'data': {
             'type': 'entry',
@@ -237,9 +370,11 @@ def upload_entry(token, flow_data, flow_slug):
         }
     }
 
-    response = requests.post(
-        f'{API_ROOT}/v2/flows/{flow_slug}/entries',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        f'/v2/flows/{flow_slug}/entries',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
     response.raise_for_status()
@@ -247,59 +382,138 @@ def upload_entry(token, flow_data, flow_slug):
     return response.json()
 
 
-def fetch_entries(token, flow_slug):
-    """Make an API request to fetch all entries of a given flow
+def fetch_entries(token, flow_slug, limit=None, offset=None):
+    """Make an API request to fetch a page of entries of a given flow
 
     Args:
         token: authorization token
         flow_slug: slug of flow to fetch entries from
+        limit: maximum number of entries in page
+        offset: number of entries to skip
 
     Returns:
         API response containing entries
     """
-    headers = {'Authorization': f'Bearer {token}'}
-
-    response = requests.get(
-        f'{API_ROOT}/v2/flows/{flow_slug}/entries',
-        headers=headers,
+    params = {}
+    if limit is not None:
+        params['page[limit]'] = limit
+    if offset is not None:
+        params['page[offset]'] = offset
+
+    response = _client.request(
+        'GET',
+        f'/v2/flows/{flow_slug}/entries',
+        token=token,
+        params=params,
     )
     response.raise_for_status()
 
     return response.json()
 
 
-def fetch_products(token):
-    """Make an API request to fetch all products in catalog
+def fetch_all_entries(token, flow_slug, page_limit=100):
+    """Make API requests to fetch all entries of a given flow page by page
 
     Args:
         token: authorization token
+        flow_slug: slug of flow to fetch entries from
+        page_limit: number of entries requested per page
 
     Returns:
-        API response containing products
+        list of all flow entries
     """
-    headers = {'Authorization': f'Bearer {token}'}
+    entries = []
+
+    while True:
+        page = fetch_entries(
+            token,
+            flow_slug,
+            limit=page_limit,
+            offset=len(entries),
+        )
+        entries.extend(page['data'])
+
+        total = page.get('meta', {}).get('results', {}).get('total')
+        if not page['data'] or total is None or len(entries) >= total:
+            return entries
+
+
+def fetch_products(token, include=None, limit=None, offset=None):
+    """Make an API request to fetch products in catalog
+
+    Args:
+        token: authorization token
+        include: related resources to include into response, i.e. main_image
+        limit: maximum number of products in page
+        offset: number of products to skip
 
-    response = requests.get(f'{API_ROOT}/v2/products', headers=headers)
+    Returns:
+        API response containing products
+    """
+    params = {}
+    if include:
+        params['include'] = include
+    if limit is not None:
+        params['page[limit]'] = limit
+    if offset is not None:
+        params['page[offset]'] = offset
+
+    response = _client.request(
+        'GET', '/v2/products', token=token, params=params or None
+    )
     response.raise_for_status()
 
     return response.json()
 
 
-def fetch_products_by_category_id(token, category_id):
+def fetch_all_products(token, include=None, page_limit=100):
+    """Make API requests to fetch all products in catalog page by page
+
+    Args:
+        token: authorization token
+        include: related resources to include into response, i.e. main_image
+        page_limit: number of products requested per page
+
+    Returns:
+        API response like dictionary containing products of all pages and
+        their included resources
+    """
+    products = []
+    included = {}
+
+    while True:
+        page = fetch_products(
+            token,
+            include=include,
+            limit=page_limit,
+            offset=len(products),
+        )
+        products.extend(page['data'])
+        for resource_type, resources in page.get('included', {}).items():
+            included.setdefault(resource_type, []).extend(resources)
+
+        total = page.get('meta', {}).get('results', {}).get('total')
+        if not page['data'] or total is None or len(products) >= total:
+            return {'data': products, 'included': included}
+
+
+def fetch_products_by_category_id(token, category_id, include=None):
     """Make an API request to fetch products filtered by category
 
     Args:
         token: authorization token
         category_id: id of catagory
+        include: related resources to include into response, i.e. main_image
 
     Returns:
         API response containing products
     """
-    headers = {'Authorization': f'Bearer {token}'}
     params = {'filter': f'eq(category.id,{category_id})'}
+    if include:
+        params['include'] = include
 
-    response = requests.get(
-        f'{API_ROOT}/v2/products', headers=headers, params=params
+    response = _client.request(
+        'GET', '/v2/products', token=token, params=params
     )
     response.raise_for_status()
 
@@ -315,29 +529,30 @@ def fetch_categories(token):
     Returns:
         API response containing categories
     """
-    headers = {'Authorization': f'Bearer {token}'}
-
-    response = requests.get(f'{API_ROOT}/v2/categories', headers=headers)
+    response = _client.request('GET', '/v2/categories', token=token)
     response.raise_for_status()
 
     return response.json()
 
 
-def fetch_product_by_id(token, product_id):
+def fetch_product_by_id(token, product_id, include=None):
     """Make an API request to fetch product details
 
     Args:
         token: authorization token
         product_id: id of product to fetch details of
+        include: related resources to include into response, i.e. main_image
 
     Returns:
         API response containing product details
     """
-    headers = {'Authorization': f'Bearer {token}'}
+    params = {'include': include} if include else None
 
-    response = requests.get(
-        f'{API_ROOT}/v2/products/{product_id}',
-        headers=headers,
+    response = _client.request(
+        'GET',
+        f'/v2/products/{product_id}',
+        token=token,
+        params=params,
     )
     response.raise_for_status()
 
@@ -354,11 +569,10 @@ def fetch_image_by_id(token, image_id):
     Returns:
         API response containing image url
     """
-    headers = {'Authorization': f'Bearer {token}'}
-
-    response = requests.get(
-        f'{API_ROOT}/v2/files/{image_id}',
-        headers=headers,
+    response = _client.request(
+        'GET',
+        f'/v2/files/{image_id}',
+        token=token,
     )
     response.raise_for_status()
 
@@ -377,11 +591,6 @@ def add_product_to_cart(token, cart_name, product_id, quantity):
     Returns:
         API response containing all cart items
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = {
         'data': {
             'id': product_id,
@@ -390,9 +599,11 @@ def add_product_to_cart(token, cart_name, product_id, quantity):
         }
     }
 
-    response = requests.post(
-        f'{API_ROOT}/v2/carts/{cart_name}/items',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        f'/v2/carts/{cart_name}/items',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
     response.raise_for_status()
@@ -410,10 +621,8 @@ def fetch_cart_items(token, cart_name):
     Returns:
         API response containing all cart items
     """
-    headers = {'Authorization': f'Bearer {token}'}
-
-    response = requests.get(
-        f'{API_ROOT}/v2/carts/{cart_name}/items', headers=headers
+    response = _client.request(
+        'GET', f'/v2/carts/{cart_name}/items', token=token
     )
     response.raise_for_status()
 
@@ -431,11 +640,10 @@ def remove_cart_item_by_id(token, cart_name, item_id):
     Returns:
         API response containing all cart items
     """
-    headers = {'Authorization': f'Bearer {token}'}
-
-    response = requests.delete(
-        f'{API_ROOT}/v2/carts/{cart_name}/items/{item_id}',
-        headers=headers,
+    response = _client.request(
+        'DELETE',
+        f'/v2/carts/{cart_name}/items/{item_id}',
+        token=token,
     )
     response.raise_for_status()
 
@@ -452,11 +660,6 @@ def create_customer(token, email):
     Returns:
         API response containing customer details
     """
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-
     data = {
         'data': {
             'type': 'customer',
@@ -466,9 +669,11 @@ def create_customer(token, email):
         }
     }
 
-    response = requests.post(
-        f'{API_ROOT}/v2/customers',
-        headers=headers,
+    response = _client.request(
+        'POST',
+        '/v2/customers',
+        token=token,
+        content_type='application/json',
         data=json.dumps(data),
     )
 
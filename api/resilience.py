@@ -0,0 +1,236 @@
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from prometheus_client import Gauge
+
+from helpers.metrics import track_upstream_call
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+circuit_state = Gauge(
+    'pizza_bot_circuit_state',
+    'State of endpoint circuit: 0 closed, 1 half-open, 2 open.',
+    ['endpoint'],
+    multiprocess_mode='max',
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """Circuit breaker of a single API endpoint.
+
+    Circuit opens after `failure_threshold` failures in a row and rejects
+    all requests for `reset_timeout` seconds. Then it becomes half-open and
+    lets a single probe request through: its success closes the circuit,
+    its failure opens it again.
+
+    Args:
+        name: name of endpoint
+        failure_threshold: number of failures in a row opening circuit
+        reset_timeout: seconds after which open circuit is probed
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = None
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self._set_state(CLOSED)
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            circuit_state.labels(endpoint=self.name).set(
+                CIRCUIT_STATE_VALUES[state]
+            )
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._set_state(HALF_OPEN)
+                self._probing = False
+
+            if self._probing:
+                return False
+            self._probing = True
+
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._set_state(CLOSED)
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if (
+                self.state == HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                self._set_state(OPEN)
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {'state': self.state, 'failures': self.failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_endpoint(url):
+    """Get endpoint name of url, i.e. api.moltin.com/v2/products
+
+    Args:
+        url: requested url
+
+    Returns:
+        host with first two segments of url path
+    """
+    parts = urlsplit(url)
+    path = '/'.join(parts.path.split('/')[:3])
+
+    return f'{parts.netloc}{path}'
+
+
+def get_breaker(endpoint):
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+
+        return _breakers[endpoint]
+
+
+def get_circuit_states():
+    """Get states of all circuit breakers, i.e. for metrics
+
+    Returns:
+        dictionary of endpoints and their circuit states
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def get_retry_after(response):
+    """Get delay requested by Retry-After header
+
+    Args:
+        response: API response
+
+    Returns:
+        seconds to wait or None if header is absent
+    """
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+
+    if retry_after.isdigit():
+        return int(retry_after)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+def get_backoff_delay(attempt, backoff, max_backoff):
+    return random.uniform(0, min(max_backoff, backoff * 2**attempt))
+
+
+def resilient_request(
+    session,
+    method,
+    url,
+    retries=3,
+    backoff=0.5,
+    max_backoff=10,
+    **kwargs,
+):
+    """Make a request guarded by circuit breaker of endpoint
+
+    Idempotent requests failed with connection error, timeout, 429 or 5xx
+    status are retried with jittered exponential backoff or after delay
+    requested by Retry-After header. Other requests are not retried.
+    Every attempt is measured in upstream call metrics of the endpoint.
+
+    Args:
+        session: requests session to make request with
+        method: HTTP method
+        url: requested url
+        retries: maximum number of retries of idempotent request
+        backoff: base delay of backoff in seconds
+        max_backoff: maximum delay between attempts in seconds
+        kwargs: other arguments passed to requests
+
+    Raises:
+        CircuitOpenError: if endpoint circuit is open
+
+    Returns:
+        API response, possibly failed one after all retries
+    """
+    breaker = get_breaker(get_endpoint(url))
+    attempts = retries + 1 if method.upper() in IDEMPOTENT_METHODS else 1
+
+    for attempt in range(attempts):
+        if not breaker.allow_request():
+            raise CircuitOpenError(f'Circuit of {breaker.name} is open')
+
+        is_last_attempt = attempt == attempts - 1
+        delay = get_backoff_delay(attempt, backoff, max_backoff)
+
+        try:
+            with track_upstream_call(breaker.name, method) as call:
+                response = session.request(method, url, **kwargs)
+                call['status'] = response.status_code
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ):
+            breaker.record_failure()
+            if is_last_attempt:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+
+            breaker.record_failure()
+            if is_last_attempt:
+                return response
+
+            retry_after = get_retry_after(response)
+            if retry_after is not None:
+                delay = min(retry_after, max_backoff)
+
+        time.sleep(delay)
@@ -1,50 +1,323 @@
+import argparse
+import hashlib
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from dotenv import load_dotenv
 
 from api.moltin_requests import (
+    API_ROOT,
+    EntityExistsError,
+    configure_client,
     create_product_image_relation,
-    fetch_auth_token,
+    fetch_all_products,
+    update_product,
     upload_image,
     upload_product,
-    EntityExistsError,
 )
+from helpers.catalog_cache import invalidate_catalog
+from helpers.product_images import get_main_image_id
+from helpers.tg_items_formatters import format_product
+from helpers.token_handers import AuthToken
 
 PRODUCTS_FILE = 'api/menu.json'
+JOURNAL_FILE = 'upload_products.journal'
+DEFAULT_WORKERS = 8
+
+COMPARED_FIELDS = (
+    'name',
+    'slug',
+    'sku',
+    'description',
+    'price',
+    'status',
+    'commodity_type',
+)
+
+
+def get_item_fingerprint(product):
+    return hashlib.sha1(
+        json.dumps(product, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class UploadJournal:
+    """Append-only journal of ids created while uploading products.
+
+    Every created product and uploaded image is written down as soon as API
+    returns its id, so interrupted upload resumes without creating them
+    again. Records of menu item are ignored once the item is changed.
+
+    Args:
+        filename: path to journal file, one json record per line
+    """
+
+    def __init__(self, filename=JOURNAL_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load ids created by previous runs
+
+        Returns:
+            dictionary of menu item keys and their latest records
+        """
+        records = {}
+        try:
+            with open(self.filename, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line may be cut by interruption
+                        continue
+
+                    known_record = records.get(record['key'], {})
+                    fingerprint = known_record.get('fingerprint')
+                    if fingerprint != record['fingerprint']:
+                        known_record = {}
+                    records[record['key']] = {**known_record, **record}
+        except OSError:
+            pass
+
+        return records
+
+    def record(self, key, fingerprint, **ids):
+        """Write down ids created for menu item
 
+        Args:
+            key: key of menu item
+            fingerprint: fingerprint of menu item, see `get_item_fingerprint`
+            ids: created ids, i.e. product_id or image_id
+        """
+        line = json.dumps({'key': key, 'fingerprint': fingerprint, **ids})
+        with self._lock:
+            with open(self.filename, 'a') as journal_file:
+                journal_file.write(f'{line}\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def remove(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
 
-def upload_products(auth_token):
-    """Upload all products entries
+
+def plan_upload(products, catalog_response, journal_records):
+    """Compare menu with existing catalog and plan pushing of changed items
 
     Args:
-        auth_token: authorization token
+        products: menu items, see PRODUCTS_FILE
+        catalog_response: API response containing products of catalog
+            and their main images
+        journal_records: records of previous runs, see `UploadJournal.load`
+
+    Returns:
+        list of plans of new or changed items, each plan is a dictionary
+        with `action` key: create, update or image
     """
-    with open(PRODUCTS_FILE, 'r') as products_file:
-        products = json.load(products_file)
+    existing_products = {}
+    for existing_product in catalog_response['data']:
+        existing_products[existing_product.get('slug')] = existing_product
+        existing_products[existing_product.get('sku')] = existing_product
 
+    image_urls = {
+        image['id']: image['link']['href']
+        for image in catalog_response.get('included', {}).get(
+            'main_images', []
+        )
+    }
+
+    plans = []
     for product in products:
+        key = str(product['id'])
+        fingerprint = get_item_fingerprint(product)
+        record = journal_records.get(key, {})
+        if record.get('fingerprint') != fingerprint:
+            record = {}
+
+        desired_product = format_product(product)['data']
+        existing_product = existing_products.get(
+            desired_product['sku']
+        ) or existing_products.get(desired_product['slug'])
+
+        if existing_product:
+            product_id = existing_product['id']
+            image_url = image_urls.get(get_main_image_id(existing_product))
+            is_changed = any(
+                existing_product.get(field) != desired_product[field]
+                for field in COMPARED_FIELDS
+            )
+            action = 'update' if is_changed else 'image'
+        else:
+            product_id = record.get('product_id')
+            image_url = None
+            action = 'image' if product_id else 'create'
+
+        relate_image = image_url != product['product_image']['url']
+        if action == 'image' and not relate_image:
+            continue
+
+        plans.append(
+            {
+                'key': key,
+                'fingerprint': fingerprint,
+                'product': product,
+                'action': action,
+                'product_id': product_id,
+                'image_id': record.get('image_id'),
+                'relate_image': relate_image,
+            }
+        )
+
+    return plans
+
+
+def push_item(auth, plan, journal):
+    """Push product, its image and their relation one after another
+
+    Product or image which already exists in elasticpath, but is not found
+    in catalog, is skipped, as the baseline uploader did.
+
+    Args:
+        auth: token provider, i.e. AuthToken
+        plan: plan of item, see `plan_upload`
+        journal: UploadJournal writing down created ids
+
+    Returns:
+        message about pushed item
+    """
+    product = plan['product']
+    product_id = plan['product_id']
+    name = product['name']
+
+    if plan['action'] == 'create':
         try:
-            product_details = upload_product(auth_token, product)
+            product_id = upload_product(auth.token, product)['data']['id']
         except EntityExistsError:
-            print('Product <{}> is already uploaded'.format(product['name']))
-        else:
-            image_url = product['product_image']['url']
-            image_details = upload_image(auth_token, image_url)
+            return 'Product <{}> is already uploaded'.format(name)
+        journal.record(plan['key'], plan['fingerprint'], product_id=product_id)
+    elif plan['action'] == 'update':
+        update_product(auth.token, product_id, product)
+
+    if not plan['relate_image']:
+        return 'Product <{}> is uploaded'.format(name)
+
+    image_id = plan['image_id']
+    if not image_id:
+        image_url = product['product_image']['url']
+        try:
+            image_id = upload_image(auth.token, image_url)['data']['id']
+        except EntityExistsError:
+            return 'Image of product <{}> is already uploaded'.format(name)
+        journal.record(plan['key'], plan['fingerprint'], image_id=image_id)
+
+    create_product_image_relation(auth.token, product_id, image_id)
+
+    return 'Product <{}> is uploaded'.format(name)
+
+
+def upload_products(
+    auth,
+    products_file=PRODUCTS_FILE,
+    workers=DEFAULT_WORKERS,
+    journal_file=JOURNAL_FILE,
+    dry_run=False,
+):
+    """Upload new and changed products entries concurrently
+
+    Items are pushed by pool of `workers` threads, steps of each item run
+    in order: product, image, relation. Journal is removed once all items
+    are uploaded, otherwise next run resumes from it.
+
+    Args:
+        auth: token provider, i.e. AuthToken
+        products_file: path to json file of menu items
+        workers: number of items pushed concurrently
+        journal_file: path to journal of created ids
+        dry_run: only print planned changes if set
+
+    Returns:
+        number of items failed to upload
+    """
+    with open(products_file, 'r') as file:
+        products = json.load(file)
+
+    journal = UploadJournal(journal_file)
+    catalog_response = fetch_all_products(auth.token, include='main_image')
+    plans = plan_upload(products, catalog_response, journal.load())
+
+    print(
+        'Products to push: {}, unchanged: {}'.format(
+            len(plans),
+            len(products) - len(plans),
+        )
+    )
+
+    if dry_run:
+        for plan in plans:
+            print('{} <{}>'.format(plan['action'], plan['product']['name']))
+        return 0
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(push_item, auth, plan, journal): plan
+            for plan in plans
+        }
+        for future in as_completed(futures):
+            plan = futures[future]
+            name = plan['product']['name']
+            try:
+                print(future.result())
+            except Exception as error:
+                # malformed item must not stop pushing of other ones
+                failures += 1
+                print('Product <{}> is not uploaded: {!r}'.format(name, error))
+
+    if not failures:
+        journal.remove()
+    if plans:
+        invalidate_catalog()
+
+    return failures
+
 
-            product_id = product_details['data']['id']
-            image_id = image_details['data']['id']
-            create_product_image_relation(auth_token, product_id, image_id)
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Upload new and changed products to elasticpath'
+    )
+    parser.add_argument('--file', default=PRODUCTS_FILE)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--journal', default=JOURNAL_FILE)
+    parser.add_argument('--dry-run', action='store_true')
 
-            print('Product <{}> is uploaded'.format(product['name']))
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
     load_dotenv()
+    args = parse_args()
 
     client_id = os.getenv('CLIENT_ID')
     client_secret = os.getenv('CLIENT_SECRET')
 
-    auth_token = fetch_auth_token(client_id, client_secret)['access_token']
+    auth = AuthToken(client_id, client_secret)
+    configure_client(
+        api_root=os.getenv('MOLTIN_API_ROOT', API_ROOT),
+        pool_size=args.workers,
+        token_provider=auth,
+    )
 
-    upload_products(auth_token)
+    failures = upload_products(
+        auth,
+        products_file=args.file,
+        workers=args.workers,
+        journal_file=args.journal,
+        dry_run=args.dry_run,
+    )
+    if failures:
+        raise SystemExit(f'{failures} products are not uploaded, run again')
@@ -2,6 +2,12 @@ from typing import Optional
 
 import requests
 
+from api.resilience import resilient_request
+
+GEOCODER_URL = 'https://geocode-maps.yandex.ru/1.x'
+
+session = requests.Session()
+
 
 def fetch_coordinates(apikey: str, address: str) -> Optional[tuple]:
     """Fetch coordinates with yandex api.
@@ -14,14 +20,16 @@ def fetch_coordinates(apikey: str, address: str) -> Optional[tuple]:
         tuple containing coordinates or None
     """
 
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(
-        base_url,
+    response = resilient_request(
+        session,
+        'GET',
+        GEOCODER_URL,
         params={
             "geocode": address,
             "apikey": apikey,
             "format": "json",
         },
+        timeout=10,
     )
     response.raise_for_status()
 
@@ -0,0 +1,564 @@
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+import zlib
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from helpers.product_images import get_main_image_id
+
+CATEGORIES = [
+    {'id': 'category-front-page', 'slug': 'front_page', 'name': 'Главная'},
+    {'id': 'category-spicy', 'slug': 'spicy', 'name': 'Острые'},
+    {
+        'id': 'category-vegetarian',
+        'slug': 'vegetarian',
+        'name': 'Вегетарианские',
+    },
+]
+
+PIZZERIAS = [
+    {
+        'id': f'pizzeria-{number}',
+        'alias': f'Пиццерия {number}',
+        'address': f'Москва, улица Пиццерии, {number}',
+        'latitude': 55.70 + number * 0.02,
+        'longitude': 37.55 + number * 0.02,
+        'deliveryman_telegram_id': 1000 + number,
+    }
+    for number in range(10)
+]
+
+
+class FakeServer:
+    """Flask app served in a background thread with artificial latency.
+
+    Every response is delayed by `latency` seconds plus uniformly random
+    jitter of up to `jitter` seconds.
+
+    Args:
+        name: name of flask app
+        latency: base delay of every response in seconds
+        jitter: maximum random addition to delay in seconds
+    """
+
+    def __init__(self, name, latency=0, jitter=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests_count = 0
+
+        self.app = Flask(name)
+        self.app.before_request(self._delay)
+        self._server = None
+        self._counter_lock = threading.Lock()
+
+    def _delay(self):
+        with self._counter_lock:
+            self.requests_count += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving in a daemon thread
+
+        Args:
+            host: interface to listen on
+            port: port to listen on, any free one by default
+
+        Returns:
+            root url of the server
+        """
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self._server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(
+            target=self._server.serve_forever,
+            name=f'{self.app.name}_server',
+            daemon=True,
+        ).start()
+
+        return f'http://{host}:{self._server.server_port}'
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+
+
+def make_product(number, categories):
+    product_id = f'product-{number}'
+    price = 300 + number * 50
+
+    return {
+        'type': 'product',
+        'id': product_id,
+        'name': f'Пицца {number}',
+        'slug': f'pizza-{number}',
+        'description': f'Описание пиццы {number}',
+        'price': [{'amount': price, 'currency': 'RUB', 'includes_tax': True}],
+        'meta': {
+            'display_price': {
+                'with_tax': {'amount': price, 'currency': 'RUB'},
+                'without_tax': {'amount': price, 'currency': 'RUB'},
+            },
+            'timestamps': {'updated_at': '2021-12-01T00:00:00Z'},
+        },
+        'relationships': {
+            'main_image': {
+                'data': {'type': 'main_image', 'id': f'image-{number}'},
+            },
+            'categories': {
+                'data': [
+                    {'type': 'category', 'id': category['id']}
+                    for category in categories
+                ],
+            },
+        },
+    }
+
+
+def make_image(image_id):
+    return {
+        'type': 'file',
+        'id': image_id,
+        'link': {'href': f'https://images.example.com/{image_id}.jpg'},
+    }
+
+
+class FakeMoltin(FakeServer):
+    """Stand-in of Moltin API endpoints used by `api.moltin_requests`.
+
+    Catalog of `products_count` products spread over fixed categories and
+    pizzerias flow are generated on start. Carts, customers, flows, fields
+    and uploaded entries are kept in memory.
+
+    Args:
+        products_count: number of products in catalog
+        latency: base delay of every response in seconds
+        jitter: maximum random addition to delay in seconds
+    """
+
+    def __init__(self, products_count=12, latency=0, jitter=0):
+        super().__init__('fake_moltin', latency, jitter)
+
+        self.products = {}
+        for number in range(products_count):
+            categories = [CATEGORIES[0], CATEGORIES[1 + number % 2]]
+            product = make_product(number, categories)
+            self.products[product['id']] = product
+        self.files = {
+            f'image-{number}': make_image(f'image-{number}')
+            for number in range(products_count)
+        }
+        self.flows = {'pizzeria': list(PIZZERIAS), 'customer_address': []}
+        self.customers = set()
+        self.carts = {}
+        self._lock = threading.Lock()
+
+        routes = [
+            ('/oauth/access_token', ['POST'], self.access_token),
+            ('/v2/products', ['GET'], self.list_products),
+            ('/v2/products', ['POST'], self.create_product),
+            ('/v2/products/<product_id>', ['GET'], self.get_product),
+            ('/v2/products/<product_id>', ['PUT'], self.update_product),
+            (
+                '/v2/products/<product_id>/relationships/main-image',
+                ['POST'],
+                self.relate_main_image,
+            ),
+            ('/v2/categories', ['GET'], self.list_categories),
+            ('/v2/files', ['POST'], self.create_file),
+            ('/v2/files/<file_id>', ['GET'], self.get_file),
+            ('/v2/flows', ['POST'], self.create_flow),
+            ('/v2/fields', ['POST'], self.create_field),
+            ('/v2/flows/<slug>/entries', ['GET'], self.list_entries),
+            ('/v2/flows/<slug>/entries', ['POST'], self.create_entry),
+            ('/v2/carts/<name>/items', ['GET'], self.get_cart),
+            ('/v2/carts/<name>/items', ['POST'], self.add_cart_item),
+            (
+                '/v2/carts/<name>/items/<item_id>',
+                ['DELETE'],
+                self.remove_cart_item,
+            ),
+            ('/v2/customers', ['POST'], self.create_customer),
+        ]
+        for rule, methods, view in routes:
+            self.app.add_url_rule(
+                rule,
+                f'{view.__name__}_{methods[0]}',
+                view,
+                methods=methods,
+            )
+
+    def access_token(self):
+        return jsonify(
+            {
+                'access_token': uuid.uuid4().hex,
+                'token_type': 'Bearer',
+                'expires_in': 3600,
+                'expires': int(time.time()) + 3600,
+            }
+        )
+
+    def _with_images(self, products, meta=None):
+        response = {'data': products}
+        if meta:
+            response['meta'] = meta
+        if request.args.get('include') == 'main_image':
+            image_ids = {
+                get_main_image_id(product)
+                for product in (
+                    products if isinstance(products, list) else [products]
+                )
+            }
+            response['included'] = {
+                'main_images': [
+                    self.files[image_id]
+                    for image_id in sorted(image_ids & set(self.files))
+                ],
+            }
+
+        return jsonify(response)
+
+    def list_products(self):
+        products = list(self.products.values())
+
+        category_filter = request.args.get('filter', '')
+        if category_filter.startswith('eq(category.id,'):
+            category_id = category_filter[len('eq(category.id,'):-1]
+            products = [
+                product
+                for product in products
+                if any(
+                    category['id'] == category_id
+                    for category in product.get('relationships', {})
+                    .get('categories', {})
+                    .get('data', [])
+                )
+            ]
+
+        total = len(products)
+        offset = int(request.args.get('page[offset]', 0))
+        limit = int(request.args.get('page[limit]', total))
+        products = products[offset:offset + limit]
+
+        return self._with_images(products, {'results': {'total': total}})
+
+    def get_product(self, product_id):
+        if product_id not in self.products:
+            return jsonify({'errors': [{'status': 404}]}), 404
+
+        return self._with_images(self.products[product_id])
+
+    def create_product(self):
+        product = request.get_json(force=True)['data']
+        with self._lock:
+            if any(
+                known['slug'] == product['slug']
+                for known in self.products.values()
+            ):
+                return jsonify({'errors': [{'status': 409}]}), 409
+
+            product_id = f'product-{uuid.uuid4().hex[:8]}'
+            self.products[product_id] = {
+                **product,
+                'id': product_id,
+                'meta': {
+                    'display_price': {
+                        'without_tax': {
+                            'amount': product['price'][0]['amount'],
+                        },
+                    },
+                },
+                'relationships': {},
+            }
+
+        return jsonify({'data': self.products[product_id]}), 201
+
+    def update_product(self, product_id):
+        product = request.get_json(force=True)['data']
+        with self._lock:
+            if product_id not in self.products:
+                return jsonify({'errors': [{'status': 404}]}), 404
+
+            stored_product = self.products[product_id]
+            self.products[product_id] = {
+                **stored_product,
+                **product,
+                'id': product_id,
+                'meta': {
+                    **stored_product['meta'],
+                    'display_price': {
+                        'without_tax': {
+                            'amount': product['price'][0]['amount'],
+                        },
+                    },
+                },
+            }
+
+        return jsonify({'data': self.products[product_id]})
+
+    def relate_main_image(self, product_id):
+        relation = request.get_json(force=True)['data']
+        with self._lock:
+            self.products[product_id].setdefault('relationships', {})[
+                'main_image'
+            ] = {'data': relation}
+
+        return jsonify({'data': relation})
+
+    def list_categories(self):
+        return jsonify({'data': CATEGORIES})
+
+    def create_file(self):
+        file_location = request.form.get('file_location', '')
+        with self._lock:
+            if any(
+                file['link']['href'] == file_location
+                for file in self.files.values()
+            ):
+                return jsonify({'errors': [{'status': 409}]}), 409
+
+            file_id = f'image-{uuid.uuid4().hex[:8]}'
+            self.files[file_id] = {
+                'type': 'file',
+                'id': file_id,
+                'link': {'href': file_location},
+            }
+
+        return jsonify({'data': self.files[file_id]}), 201
+
+    def get_file(self, file_id):
+        if file_id not in self.files:
+            return jsonify({'errors': [{'status': 404}]}), 404
+
+        return jsonify({'data': self.files[file_id]})
+
+    def create_flow(self):
+        flow = request.get_json(force=True)['data']
+        with self._lock:
+            self.flows.setdefault(flow['slug'], [])
+
+        return jsonify({'data': {**flow, 'id': uuid.uuid4().hex}}), 201
+
+    def create_field(self):
+        field = request.get_json(force=True)['data']
+
+        return jsonify({'data': {**field, 'id': uuid.uuid4().hex}}), 201
+
+    def list_entries(self, slug):
+        entries = self.flows.get(slug, [])
+        limit = int(request.args.get('page[limit]', 100))
+        offset = int(request.args.get('page[offset]', 0))
+
+        return jsonify(
+            {
+                'data': entries[offset:offset + limit],
+                'meta': {'results': {'total': len(entries)}},
+            }
+        )
+
+    def create_entry(self, slug):
+        entry = {
+            **request.get_json(force=True)['data'],
+            'id': uuid.uuid4().hex,
+        }
+        with self._lock:
+            self.flows.setdefault(slug, []).append(entry)
+
+        return jsonify({'data': entry}), 201
+
+    def _render_cart(self, name):
+        items = []
+        total = 0
+        for product_id, quantity in self.carts.get(name, {}).items():
+            product = self.products[product_id]
+            price = product['meta']['display_price']['without_tax']['amount']
+            image = self.files.get(get_main_image_id(product))
+            total += price * quantity
+            items.append(
+                {
+                    'type': 'cart_item',
+                    'id': f'item-{product_id}',
+                    'product_id': product_id,
+                    'name': product['name'],
+                    'quantity': quantity,
+                    'image': {'href': image['link']['href'] if image else ''},
+                    'unit_price': {'amount': price},
+                    'value': {'amount': price * quantity},
+                    'meta': {
+                        'display_price': {
+                            'without_tax': {
+                                'unit': {'amount': price},
+                                'value': {'amount': price * quantity},
+                            },
+                        },
+                    },
+                }
+            )
+
+        return jsonify(
+            {
+                'data': items,
+                'meta': {
+                    'display_price': {'without_tax': {'amount': total}},
+                },
+            }
+        )
+
+    def get_cart(self, name):
+        with self._lock:
+            return self._render_cart(name)
+
+    def add_cart_item(self, name):
+        item = request.get_json(force=True)['data']
+        if item['id'] not in self.products:
+            return jsonify({'errors': [{'status': 404}]}), 404
+
+        with self._lock:
+            cart = self.carts.setdefault(name, {})
+            cart[item['id']] = cart.get(item['id'], 0) + item['quantity']
+
+            return self._render_cart(name)
+
+    def remove_cart_item(self, name, item_id):
+        with self._lock:
+            self.carts.get(name, {}).pop(item_id.replace('item-', ''), None)
+
+            return self._render_cart(name)
+
+    def create_customer(self):
+        email = request.get_json(force=True)['data']['email']
+        with self._lock:
+            if email in self.customers:
+                return jsonify({'errors': [{'status': 409}]}), 409
+            self.customers.add(email)
+
+        return jsonify({'data': {'type': 'customer', 'email': email}}), 201
+
+
+class FakeYandexGeocoder(FakeServer):
+    """Stand-in of Yandex geocoder placing addresses around Moscow.
+
+    Coordinates are derived from address text, so the same address is
+    always found at the same place. Addresses containing `nowhere` are
+    not found.
+
+    Args:
+        latency: base delay of every response in seconds
+        jitter: maximum random addition to delay in seconds
+    """
+
+    def __init__(self, latency=0, jitter=0):
+        super().__init__('fake_yandex', latency, jitter)
+        self.app.add_url_rule('/1.x', 'geocode', self.geocode)
+
+    def geocode(self):
+        address = request.args.get('geocode', '')
+        if 'nowhere' in address:
+            members = []
+        else:
+            address_hash = zlib.crc32(address.encode())
+            latitude = 55.65 + (address_hash % 1000) / 5000
+            longitude = 37.50 + (address_hash // 1000 % 1000) / 5000
+            members = [
+                {'GeoObject': {'Point': {'pos': f'{longitude} {latitude}'}}},
+            ]
+
+        return jsonify(
+            {'response': {'GeoObjectCollection': {'featureMember': members}}}
+        )
+
+
+class FakeTelegramBotAPI(FakeServer):
+    """Stand-in of Bot API methods called by the telegram bot.
+
+    Sending and editing methods answer with a message in the requested
+    chat, other methods answer with True. Every call is counted by method name.
+
+    Args:
+        latency: base delay of every response in seconds
+        jitter: maximum random addition to delay in seconds
+    """
+
+    def __init__(self, latency=0, jitter=0):
+        super().__init__('fake_telegram', latency, jitter)
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.app.add_url_rule(
+            '/bot<token>/<method>',
+            'call',
+            self.call,
+            methods=['GET', 'POST'],
+        )
+
+    def call(self, token, method):
+        params = request.get_json(silent=True) or request.form.to_dict()
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            message_id = next(self._message_ids)
+
+        if method == 'getMe':
+            result = {
+                'id': 1,
+                'is_bot': True,
+                'first_name': 'Fake',
+                'username': 'fake_bot',
+            }
+        elif method.startswith(('send', 'edit')):
+            result = {
+                'message_id': int(params.get('message_id', message_id)),
+                'date': int(time.time()),
+                'chat': {
+                    'id': int(params.get('chat_id', 0)),
+                    'type': 'private',
+                },
+                'text': params.get('text', ''),
+            }
+            if method in ('sendPhoto', 'editMessageMedia'):
+                result['photo'] = [
+                    {
+                        'file_id': f'photo-{message_id}',
+                        'file_unique_id': f'photo-{message_id}',
+                        'width': 640,
+                        'height': 480,
+                    }
+                ]
+        else:
+            result = True
+
+        return jsonify({'ok': True, 'result': result})
+
+
+class FakeGraphAPI(FakeServer):
+    """Stand-in of facebook Send API counting sent messages.
+
+    Args:
+        latency: base delay of every response in seconds
+        jitter: maximum random addition to delay in seconds
+    """
+
+    def __init__(self, latency=0, jitter=0):
+        super().__init__('fake_graph', latency, jitter)
+        self.sent_messages = 0
+        self._lock = threading.Lock()
+        self.app.add_url_rule(
+            '/v2.6/me/messages',
+            'send',
+            self.send,
+            methods=['POST'],
+        )
+
+    def send(self):
+        recipient_id = request.get_json(force=True)['recipient']['id']
+        with self._lock:
+            self.sent_messages += 1
+
+        return jsonify(
+            {'recipient_id': recipient_id, 'message_id': uuid.uuid4().hex}
+        )
@@ -0,0 +1,229 @@
+import itertools
+import random
+import time
+
+CHECKOUT_PAYLOAD = 'pizza-bot-payload'
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake'}
+
+
+def make_user(user_id):
+    return {
+        'id': user_id,
+        'is_bot': False,
+        'first_name': f'Client {user_id}',
+        'language_code': 'ru',
+    }
+
+
+def make_message(user_id, sender=None, **content):
+    return {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': sender or make_user(user_id),
+        **content,
+    }
+
+
+def make_text_update(user_id, text):
+    content = {'text': text}
+    if text.startswith('/'):
+        content['entities'] = [
+            {'type': 'bot_command', 'offset': 0, 'length': len(text)},
+        ]
+
+    return {
+        'update_id': next(_update_ids),
+        'message': make_message(user_id, **content),
+    }
+
+
+def make_location_update(user_id, latitude, longitude):
+    return {
+        'update_id': next(_update_ids),
+        'message': make_message(
+            user_id,
+            location={'latitude': latitude, 'longitude': longitude},
+        ),
+    }
+
+
+def make_callback_update(user_id, data, photo=False):
+    if photo:
+        content = {
+            'photo': [
+                {
+                    'file_id': 'photo',
+                    'file_unique_id': 'photo',
+                    'width': 640,
+                    'height': 480,
+                }
+            ],
+        }
+    else:
+        content = {'text': 'Каталог'}
+
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_message_ids)),
+            'from': make_user(user_id),
+            'chat_instance': str(user_id),
+            'message': make_message(user_id, sender=BOT_USER, **content),
+            'data': data,
+        },
+    }
+
+
+def make_pre_checkout_update(user_id, total_amount):
+    return {
+        'update_id': next(_update_ids),
+        'pre_checkout_query': {
+            'id': str(next(_message_ids)),
+            'from': make_user(user_id),
+            'currency': 'RUB',
+            'total_amount': total_amount,
+            'invoice_payload': CHECKOUT_PAYLOAD,
+        },
+    }
+
+
+def make_payment_update(user_id, total_amount):
+    return {
+        'update_id': next(_update_ids),
+        'message': make_message(
+            user_id,
+            successful_payment={
+                'currency': 'RUB',
+                'total_amount': total_amount,
+                'invoice_payload': CHECKOUT_PAYLOAD,
+                'telegram_payment_charge_id': f'charge-{user_id}',
+                'provider_payment_charge_id': f'provider-{user_id}',
+            },
+        ),
+    }
+
+
+def generate_tg_journey(
+    user_id, product_ids, rng=random, typed_addresses=True
+):
+    """Generate telegram updates of a client ordering pizza
+
+    Journey: start, menu, product, adding to cart, cart, email, address
+    or location, delivery option and payment. Every second client types
+    address instead of sending location, some clients look through
+    several products before adding one.
+
+    Args:
+        user_id: telegram id of client
+        product_ids: ids of catalog products
+        rng: random numbers generator
+        typed_addresses: whether some clients type address, otherwise all
+            of them send location
+
+    Returns:
+        list of telegram update dictionaries
+    """
+    updates = [make_text_update(user_id, '/start')]
+
+    for _ in range(rng.randint(0, 2)):
+        updates.append(make_callback_update(user_id, rng.choice(product_ids)))
+        updates.append(
+            make_callback_update(user_id, 'Back to menu', photo=True)
+        )
+
+    product_id = rng.choice(product_ids)
+    updates.extend(
+        [
+            make_callback_update(user_id, product_id),
+            make_callback_update(user_id, f'{product_id};1', photo=True),
+            make_callback_update(user_id, 'Pay'),
+            make_text_update(user_id, f'client{user_id}@example.com'),
+        ]
+    )
+
+    if user_id % 2 or not typed_addresses:
+        updates.append(
+            make_location_update(
+                user_id,
+                55.70 + rng.uniform(0, 0.2),
+                37.55 + rng.uniform(0, 0.2),
+            )
+        )
+    else:
+        updates.append(
+            make_text_update(user_id, f'Москва, ул. Клиента, д. {user_id}')
+        )
+
+    total_amount = 100000
+    updates.extend(
+        [
+            make_callback_update(user_id, 'delivery'),
+            make_pre_checkout_update(user_id, total_amount),
+            make_payment_update(user_id, total_amount),
+        ]
+    )
+
+    return updates
+
+
+def make_fb_event(user_id, message=None, payload=None):
+    event = {
+        'sender': {'id': str(user_id)},
+        'recipient': {'id': 'page'},
+        'timestamp': int(time.time() * 1000),
+    }
+    if message:
+        event['message'] = {'mid': str(next(_message_ids)), 'text': message}
+    if payload:
+        event['postback'] = {'title': payload, 'payload': payload}
+
+    return event
+
+
+def generate_fb_journey(user_id, products, category_slugs, rng=random):
+    """Generate facebook messaging events of a client filling cart
+
+    Journey: greeting, menu category, adding products to cart, cart,
+    removing product from cart and returning to menu.
+
+    Args:
+        user_id: facebook id of client
+        products: catalog products
+        category_slugs: slugs of catalog categories
+        rng: random numbers generator
+
+    Returns:
+        list of facebook messaging event dictionaries
+    """
+    first_product, second_product = rng.sample(products, 2)
+
+    return [
+        make_fb_event(user_id, message='Привет'),
+        make_fb_event(
+            user_id,
+            payload=f'CATEGORY_{rng.choice(category_slugs)}',
+        ),
+        make_fb_event(
+            user_id,
+            payload=f'ADD_TO_CART_{first_product["id"]}_'
+            f'{first_product["name"]}',
+        ),
+        make_fb_event(
+            user_id,
+            payload=f'ADD_TO_CART_{second_product["id"]}_'
+            f'{second_product["name"]}',
+        ),
+        make_fb_event(user_id, payload='CART'),
+        make_fb_event(
+            user_id,
+            payload=f'REMOVE_FROM_CART_item-{first_product["id"]}_'
+            f'{first_product["name"]}',
+        ),
+        make_fb_event(user_id, payload='BACK_TO_MENU'),
+    ]
@@ -0,0 +1,141 @@
+import functools
+import math
+import threading
+import time
+
+
+def get_percentile(values, percent):
+    """Get percentile of values by nearest-rank method
+
+    Args:
+        values: sorted list of numbers
+        percent: percentile to get, i.e. 95
+
+    Returns:
+        percentile value or None for empty list
+    """
+    if not values:
+        return None
+
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+
+    return values[rank - 1]
+
+
+class LatencyRecorder:
+    """Thread-safe collector of handler timings.
+
+    Args:
+        expected: number of records after which `wait` returns
+    """
+
+    def __init__(self, expected=0):
+        self.expected = expected
+        self.timings = {}
+        self.errors = {}
+        self.started_at = None
+        self.finished_at = None
+
+        self._condition = threading.Condition()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def record(self, name, duration, failed=False):
+        with self._condition:
+            self.timings.setdefault(name, []).append(duration)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+            if self.count >= self.expected:
+                self.finished_at = time.perf_counter()
+                self._condition.notify_all()
+
+    @property
+    def count(self):
+        return sum(len(durations) for durations in self.timings.values())
+
+    def wrap(self, name, function):
+        """Wrap function to record its duration under given name
+
+        Args:
+            name: name of record, i.e. handler name
+            function: function to time
+
+        Returns:
+            wrapped function
+        """
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            started_at = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.record(name, time.perf_counter() - started_at, failed)
+
+        return timed_function
+
+    def wait(self, timeout=None):
+        """Wait until expected number of records is collected
+
+        Args:
+            timeout: maximum seconds to wait
+
+        Returns:
+            True if all records are collected
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.count >= self.expected,
+                timeout,
+            )
+
+    def get_elapsed(self):
+        finished_at = self.finished_at or time.perf_counter()
+
+        return finished_at - self.started_at
+
+
+def format_report(recorder, title, extra_lines=()):
+    """Format table of handler latencies and overall throughput
+
+    Args:
+        recorder: LatencyRecorder with collected timings
+        title: report title, i.e. tg_bot
+        extra_lines: additional lines appended to report
+
+    Returns:
+        report text
+    """
+    header = (
+        f'{"handler":<28}{"count":>7}{"errors":>8}'
+        f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+    )
+    lines = [title, header, '-' * len(header)]
+
+    for name, durations in sorted(recorder.timings.items()):
+        durations = sorted(durations)
+        percentiles = [
+            get_percentile(durations, percent) * 1000
+            for percent in (50, 95, 99)
+        ]
+        lines.append(
+            f'{name:<28}{len(durations):>7}{recorder.errors.get(name, 0):>8}'
+            + ''.join(f'{value:>10.1f}' for value in percentiles)
+        )
+
+    elapsed = recorder.get_elapsed()
+    lines.extend(
+        [
+            '-' * len(header),
+            f'updates: {recorder.count}, elapsed: {elapsed:.2f} s, '
+            f'throughput: {recorder.count / elapsed:.1f} updates/s',
+            *extra_lines,
+        ]
+    )
+
+    return '\n'.join(lines)
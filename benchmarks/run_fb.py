@@ -0,0 +1,155 @@
+"""Load test of facebook bot against local fake servers.
+
+Bot keeps its state in redis, so `REDIS_HOST`, `REDIS_PORT` and
+`REDIS_PASSWORD` must point to a disposable redis db.
+
+Usage:
+    python -m benchmarks.run_fb --users 100 --moltin-latency 0.05
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Load test of facebook bot against fake servers'
+    )
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--products', type=int, default=12)
+    parser.add_argument('--moltin-latency', type=float, default=0.05)
+    parser.add_argument('--graph-latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--partitions', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600)
+
+    return parser.parse_args()
+
+
+def make_timed_handler(handle_user_input, recorder):
+    """Make user input handler recording its duration by event type
+
+    Args:
+        handle_user_input: bot user input handler
+        recorder: LatencyRecorder collecting durations
+
+    Returns:
+        timed user input handler
+    """
+    from helpers.fb_action_handlers import get_event_type
+
+    def timed_handle_user_input(**handler_params):
+        name = get_event_type(
+            handler_params['message'],
+            handler_params['payload'],
+        )
+        started_at = time.perf_counter()
+        failed = True
+        try:
+            result = handle_user_input(**handler_params)
+            failed = False
+            return result
+        finally:
+            recorder.record(name, time.perf_counter() - started_at, failed)
+
+    return timed_handle_user_input
+
+
+def wait_for_menus(db, slugs, timeout):
+    deadline = time.monotonic() + timeout
+    while db.exists(*slugs) < len(slugs):
+        if time.monotonic() > deadline:
+            raise TimeoutError('Menus are not cached')
+        time.sleep(0.1)
+
+
+def main():
+    args = parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='fb_bench_'))
+
+    from benchmarks.fake_servers import CATEGORIES, FakeGraphAPI, FakeMoltin
+    from benchmarks.journeys import generate_fb_journey
+    from benchmarks.report import LatencyRecorder, format_report
+
+    moltin = FakeMoltin(args.products, args.moltin_latency, args.jitter)
+    graph = FakeGraphAPI(args.graph_latency, args.jitter)
+
+    os.environ.update(
+        {
+            'MOLTIN_API_ROOT': moltin.start(),
+            'CLIENT_ID': 'benchmark',
+            'CLIENT_SECRET': 'benchmark',
+            'PAGE_ACCESS_TOKEN': 'benchmark',
+            'VERIFY_TOKEN': 'benchmark',
+            'FB_QUEUE_PARTITIONS': str(args.partitions),
+        }
+    )
+
+    from helpers import fb_chat_replying
+
+    fb_chat_replying.GRAPH_API_URL = graph.start()
+
+    import fb_bot
+
+    slugs = [category['slug'] for category in CATEGORIES]
+    wait_for_menus(fb_bot.app.db, slugs, args.timeout)
+
+    rng = random.Random(args.seed)
+    products = list(moltin.products.values())
+    first_user_id = rng.randrange(10**9, 10**10)
+    journeys = [
+        generate_fb_journey(first_user_id + user_number, products, slugs, rng)
+        for user_number in range(args.users)
+    ]
+    # users make their steps at the same time, as they do in real life
+    events = [
+        event
+        for step in itertools.zip_longest(*journeys)
+        for event in step
+        if event
+    ]
+
+    recorder = LatencyRecorder(expected=len(events))
+    fb_bot.handle_user_input = make_timed_handler(
+        fb_bot.handle_user_input,
+        recorder,
+    )
+
+    client = fb_bot.app.test_client()
+    recorder.start()
+    for event in events:
+        client.post(
+            '/',
+            json={
+                'object': 'page',
+                'entry': [{'id': 'page', 'messaging': [event]}],
+            },
+        )
+    completed = recorder.wait(args.timeout)
+
+    print(
+        format_report(
+            recorder,
+            f'fb_bot: {args.users} users, {len(events)} events',
+            extra_lines=[
+                f'completed: {completed}',
+                f'moltin requests: {moltin.requests_count}',
+                f'graph api messages: {graph.sent_messages}',
+            ],
+        )
+    )
+
+    for worker in fb_bot.event_workers:
+        worker.stop()
+    fb_bot.scheduler.shutdown(wait=False)
+    for server in (moltin, graph):
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
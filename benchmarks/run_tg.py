@@ -0,0 +1,144 @@
+"""Load test of telegram bot against local fake servers.
+
+Usage:
+    python -m benchmarks.run_tg --users 100 --moltin-latency 0.05
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+
+from telegram import Update
+from telegram.ext import ConversationHandler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Load test of telegram bot against fake servers'
+    )
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--products', type=int, default=12)
+    parser.add_argument('--moltin-latency', type=float, default=0.05)
+    parser.add_argument('--yandex-latency', type=float, default=0.1)
+    parser.add_argument('--telegram-latency', type=float, default=0.03)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600)
+
+    return parser.parse_args()
+
+
+def wrap_callbacks(conversation_handler, recorder):
+    """Make every handler of conversation record its duration
+
+    Args:
+        conversation_handler: bot conversation handler
+        recorder: LatencyRecorder collecting durations
+    """
+    handlers = [
+        *conversation_handler.entry_points,
+        *itertools.chain.from_iterable(conversation_handler.states.values()),
+        *conversation_handler.fallbacks,
+    ]
+    for handler in handlers:
+        handler.callback = recorder.wrap(
+            handler.callback.__name__,
+            handler.callback,
+        )
+
+
+def main():
+    args = parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='tg_bench_'))
+
+    from benchmarks.fake_servers import (
+        FakeMoltin,
+        FakeTelegramBotAPI,
+        FakeYandexGeocoder,
+    )
+    from benchmarks.journeys import generate_tg_journey
+    from benchmarks.report import LatencyRecorder, format_report
+
+    moltin = FakeMoltin(args.products, args.moltin_latency, args.jitter)
+    yandex = FakeYandexGeocoder(args.yandex_latency, args.jitter)
+    telegram = FakeTelegramBotAPI(args.telegram_latency, args.jitter)
+
+    os.environ.pop('REDIS_HOST', None)
+    os.environ.update(
+        {
+            'TG_PIZZA_BOT_TOKEN': '123456:benchmark',
+            'TG_API_BASE_URL': f'{telegram.start()}/bot',
+            'MOLTIN_API_ROOT': moltin.start(),
+            'CLIENT_ID': 'benchmark',
+            'CLIENT_SECRET': 'benchmark',
+            'YANDEX_API_TOKEN': 'benchmark',
+            'PAYMENT_PROVIDER_TOKEN': 'benchmark',
+            'TG_WORKERS': str(args.workers),
+            'TG_SEND_RATE': '100000',
+            'TG_CHAT_SEND_RATE': '100000',
+        }
+    )
+
+    from api import yandex_api_requests
+
+    yandex_api_requests.GEOCODER_URL = f'{yandex.start()}/1.x'
+
+    from helpers.tg_send_queue import get_send_queue
+    from tg_bot import create_updater
+
+    updater = create_updater()
+    dispatcher = updater.dispatcher
+
+    conversation_handler = next(
+        handler
+        for handler in dispatcher.handlers[0]
+        if isinstance(handler, ConversationHandler)
+    )
+
+    rng = random.Random(args.seed)
+    product_ids = list(moltin.products)
+    journeys = [
+        generate_tg_journey(1000000 + user_number, product_ids, rng)
+        for user_number in range(args.users)
+    ]
+    # users make their steps at the same time, as they do in real life
+    updates = [
+        Update.de_json(update, dispatcher.bot)
+        for step in itertools.zip_longest(*journeys)
+        for update in step
+        if update
+    ]
+
+    recorder = LatencyRecorder(expected=len(updates))
+    wrap_callbacks(conversation_handler, recorder)
+
+    recorder.start()
+    for update in updates:
+        dispatcher.process_update(update)
+    completed = recorder.wait(args.timeout)
+
+    print(
+        format_report(
+            recorder,
+            f'tg_bot: {args.users} users, {len(updates)} updates',
+            extra_lines=[
+                f'completed: {completed}',
+                f'moltin requests: {moltin.requests_count}',
+                f'yandex requests: {yandex.requests_count}',
+                f'bot api calls: {telegram.calls}',
+                f'send queue: {get_send_queue().get_metrics()}',
+            ],
+        )
+    )
+
+    dispatcher.executor.shutdown(wait=False)
+    get_send_queue().stop()
+    for server in (moltin, yandex, telegram):
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Fake telegram posting client journeys to webhook of telegram bot.
+
+Fake Bot API and elasticpath servers are started first, then webhook
+workers have to be launched with printed environment variables, i.e.:
+
+    python -m benchmarks.run_tg_webhook \
+        --webhook-url http://localhost:8200/telegram
+    gunicorn tg_webhook:app -w 4 -b localhost:8200
+
+Updates of every client are posted one after another with a pause, like
+client reading bot replies. Updates are spread over all webhook urls if
+several are given, like load balancer spreads them over workers. Clients
+send location instead of typing address, so geocoder is not faked.
+"""
+import argparse
+import itertools
+import random
+import threading
+import time
+
+import requests
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Post client journeys to webhook of telegram bot'
+    )
+    parser.add_argument('--webhook-url', nargs='+', required=True)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--products', type=int, default=12)
+    parser.add_argument('--telegram-port', type=int, default=8081)
+    parser.add_argument('--moltin-port', type=int, default=8082)
+    parser.add_argument('--think-time', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120)
+
+    return parser.parse_args()
+
+
+def wait_for_webhooks(urls, timeout):
+    """Wait until all webhook workers accept connections
+
+    Args:
+        urls: webhook urls
+        timeout: seconds to wait for
+    """
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                requests.get(url, timeout=1)
+                break
+            except requests.exceptions.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Webhook {url} is not available')
+                time.sleep(0.5)
+
+
+def post_journey(journey, urls, think_time, failures):
+    """Post updates of a client one after another
+
+    Args:
+        journey: list of telegram update dictionaries
+        urls: webhook urls updates are spread over
+        think_time: seconds between updates
+        failures: list collecting failed posts
+    """
+    for url, update in zip(itertools.cycle(urls), journey):
+        try:
+            response = requests.post(url, json=update, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as error:
+            failures.append(error)
+        time.sleep(think_time)
+
+
+def wait_for_orders(telegram, users, timeout):
+    """Wait until couriers get locations of all clients
+
+    Args:
+        telegram: FakeTelegramBotAPI the bot calls
+        users: number of clients
+        timeout: seconds to wait for
+
+    Returns:
+        number of orders passed to couriers
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if telegram.calls.get('sendLocation', 0) >= users:
+            break
+        time.sleep(0.5)
+
+    return telegram.calls.get('sendLocation', 0)
+
+
+def main():
+    args = parse_args()
+
+    from benchmarks.fake_servers import FakeMoltin, FakeTelegramBotAPI
+    from benchmarks.journeys import generate_tg_journey
+
+    moltin = FakeMoltin(args.products)
+    telegram = FakeTelegramBotAPI()
+    moltin_url = moltin.start(port=args.moltin_port)
+    telegram_url = telegram.start(port=args.telegram_port)
+
+    print('Launch webhook workers with environment variables:')
+    print('TG_PIZZA_BOT_TOKEN=123456:fake')
+    print(f'TG_API_BASE_URL={telegram_url}/bot')
+    print(f'MOLTIN_API_ROOT={moltin_url}')
+    print('CLIENT_ID=fake')
+    print('CLIENT_SECRET=fake')
+    print('YANDEX_API_TOKEN=fake')
+    print('PAYMENT_PROVIDER_TOKEN=fake')
+
+    wait_for_webhooks(args.webhook_url, args.timeout)
+
+    rng = random.Random(args.seed)
+    product_ids = list(moltin.products)
+    journeys = [
+        generate_tg_journey(
+            1000000 + user_number,
+            product_ids,
+            rng,
+            typed_addresses=False,
+        )
+        for user_number in range(args.users)
+    ]
+
+    urls = args.webhook_url
+    failures = []
+    threads = []
+    for number, journey in enumerate(journeys):
+        # clients start on different workers
+        shift = number % len(urls)
+        threads.append(
+            threading.Thread(
+                target=post_journey,
+                args=(
+                    journey,
+                    urls[shift:] + urls[:shift],
+                    args.think_time,
+                    failures,
+                ),
+            )
+        )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    orders = wait_for_orders(telegram, args.users, args.timeout)
+
+    print(f'posted updates: {sum(len(journey) for journey in journeys)}')
+    print(f'failed posts: {len(failures)}')
+    print(f'orders passed to couriers: {orders} of {args.users}')
+    print(f'moltin requests: {moltin.requests_count}')
+    print(f'bot api calls: {telegram.calls}')
+
+    moltin.stop()
+    telegram.stop()
+
+
+if __name__ == '__main__':
+    main()
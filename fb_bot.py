@@ -1,13 +1,41 @@
 from datetime import datetime
+import logging
 import os
 
 from dotenv import load_dotenv
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_apscheduler import APScheduler
 from redis import Redis
-
-from helpers.fb_action_handlers import handle_menu_caching, handle_user_input
-from helpers.token_handers import AuthToken
+from requests.exceptions import RequestException
+
+from api.moltin_requests import API_ROOT, configure_client
+from helpers.carts import carts
+from helpers.catalog_snapshot import (
+    CATALOG_SNAPSHOT_FILE,
+    load_and_seed_catalog,
+    save_catalog_snapshot,
+)
+from helpers.fb_action_handlers import (
+    get_event_type,
+    handle_menu_caching,
+    handle_user_input,
+)
+from helpers.fb_event_queue import (
+    QueueDepthCollector,
+    enqueue_events,
+    start_event_workers,
+)
+from helpers.metrics import (
+    CONTENT_TYPE,
+    instrumented,
+    register_shared_collector,
+    render_metrics,
+    track_handler,
+)
+from helpers.profiler import handle_profile_request
+from helpers.token_handers import RedisAuthToken
+
+logger = logging.getLogger(__name__)
 
 
 class Config:
@@ -18,22 +46,36 @@ class Config:
 class FlaskApp(Flask):
     load_dotenv()
 
-    client_id = os.getenv('CLIENT_ID')
-    client_secret = os.getenv('CLIENT_SECRET')
-    auth = AuthToken(client_id, client_secret)
-
     redis_password = os.getenv('REDIS_PASSWORD', '')
     redis_host = os.getenv('REDIS_HOST', 'localhost')
     redis_port = os.getenv('REDIS_PORT', 6379)
     db = Redis(host=redis_host, port=redis_port, password=redis_password)
+    partitions = int(os.getenv('FB_QUEUE_PARTITIONS', 8))
+    state_ttl = int(os.getenv('FB_STATE_TTL', 7 * 24 * 3600))
+
+    client_id = os.getenv('CLIENT_ID')
+    client_secret = os.getenv('CLIENT_SECRET')
+    moltin_pool_size = int(os.getenv('MOLTIN_POOL_SIZE', 10))
+    auth = RedisAuthToken(client_id, client_secret, db)
+    moltin = configure_client(
+        api_root=os.getenv('MOLTIN_API_ROOT', API_ROOT),
+        pool_size=moltin_pool_size,
+        token_provider=auth,
+    )
+
+    snapshot_file = os.getenv('CATALOG_SNAPSHOT_FILE', CATALOG_SNAPSHOT_FILE)
+    snapshot_interval = int(os.getenv('CATALOG_SNAPSHOT_INTERVAL', 600))
 
     fb_token = os.getenv('PAGE_ACCESS_TOKEN')
     verify_token = os.getenv('VERIFY_TOKEN')
+    profiler_token = os.getenv('PROFILER_TOKEN')
 
 
 app = FlaskApp(__name__)
 app.config.from_object(Config())
 
+load_and_seed_catalog(app.snapshot_file)
+
 scheduler = APScheduler()
 scheduler.init_app(app)
 scheduler.start()
@@ -41,7 +83,25 @@ scheduler.start()
 
 @scheduler.task('interval', minutes=1, next_run_time=datetime.now())
 def cache_menu():
-    handle_menu_caching(app.auth, app.db)
+    try:
+        handle_menu_caching(app.auth, app.db)
+    except RequestException:
+        if app.db.exists('front_page'):
+            raise
+
+        snapshot = load_and_seed_catalog(app.snapshot_file)
+        if not snapshot:
+            raise
+        handle_menu_caching(app.auth, app.db, snapshot)
+
+
+@scheduler.task(
+    'interval',
+    seconds=app.snapshot_interval,
+    next_run_time=datetime.now(),
+)
+def save_snapshot():
+    save_catalog_snapshot(app.auth.token, app.snapshot_file)
 
 
 @app.route('/', methods=['GET'])
@@ -57,38 +117,127 @@ def verify():
     return 'Hello world', 200
 
 
+def get_menu_slugs(events):
+    """Gets slugs of menus which may be shown while handling events."""
+
+    slugs = {'front_page'}
+    for event in events:
+        payload = event.get('postback', {}).get('payload', '')
+        if payload.startswith('CATEGORY_'):
+            slugs.add(payload.replace('CATEGORY_', ''))
+
+    return list(slugs)
+
+
+def process_events(events, heartbeat=None):
+    """Handles batch of facebook messaging events.
+
+    States of all senders and all needed menus are loaded from redis at
+    once and new states are written back in a single pipeline. Failure of
+    one event is logged and doesn't stop handling of the rest of batch.
+    `heartbeat` is called after every event, i.e. to renew queue lock.
+    """
+
+    user_ids = list({event['sender']['id'] for event in events})
+    menu_slugs = get_menu_slugs(events)
+
+    stored_values = app.db.mget(
+        [f'STATE_{user_id}' for user_id in user_ids] + menu_slugs
+    )
+    states = {
+        user_id: state.decode() if state else 'MENU'
+        for user_id, state in zip(user_ids, stored_values)
+    }
+    menus = dict(zip(menu_slugs, stored_values[len(user_ids):]))
+
+    try:
+        for event in events:
+            try:
+                process_event(event, states, menus)
+            except Exception:
+                logger.exception('Failed to process event %s', event)
+            if heartbeat:
+                heartbeat()
+    finally:
+        pipeline = app.db.pipeline(transaction=False)
+        for user_id, state in states.items():
+            pipeline.set(f'STATE_{user_id}', state, ex=app.state_ttl)
+        pipeline.execute()
+
+
+def process_event(event, states, menus):
+    """Handles single messaging event updating state of its sender."""
+
+    user_id = event['sender']['id']
+
+    message = event.get('message')
+    postback = event.get('postback')
+
+    if not (message or postback):
+        return
+
+    message = message.get('text') if message else None
+    payload = postback['payload'] if postback else None
+    if not (message or payload):
+        return
+
+    with track_handler('fb', get_event_type(message, payload)):
+        states[user_id] = (
+            handle_user_input(
+                menus=menus,
+                state=states[user_id],
+                user_id=user_id,
+                auth=app.auth,
+                fb_token=app.fb_token,
+                message=message,
+                payload=payload,
+            )
+            or states[user_id]
+        )
+
+
+carts.db = app.db
+event_workers = start_event_workers(app.db, process_events, app.partitions)
+register_shared_collector(QueueDepthCollector(app.db, app.partitions))
+
+
 @app.route('/', methods=['POST'])
+@instrumented('fb')
 def webhook():
-    """Webhook to handle facebook messages."""
+    """Webhook to enqueue facebook messages."""
 
     data = request.get_json()
 
-    if data['object'] == 'page':
-        for entry in data['entry']:
-            for event in entry['messaging']:
-                user_id = event['sender']['id']
-
-                if state_in_db := app.db.get(f'STATE_{user_id}'):
-                    state = state_in_db.decode()
-                else:
-                    state = 'MENU'
-
-                message = event.get('message')
-                postback = event.get('postback')
-
-                if message or postback:
-                    message = message['text'] if message else None
-                    payload = postback['payload'] if postback else None
-
-                    state = handle_user_input(
-                        db=app.db,
-                        state=state,
-                        user_id=user_id,
-                        auth=app.auth,
-                        fb_token=app.fb_token,
-                        message=message,
-                        payload=payload,
-                    )
-                    app.db.set(f'STATE_{user_id}', state)
+    if not data or data.get('object') != 'page':
+        return 'Unsupported object', 400
+
+    events = [
+        event
+        for entry in data.get('entry', [])
+        for event in entry.get('messaging', [])
+        if 'sender' in event
+    ]
+    if events:
+        enqueue_events(app.db, events, app.partitions)
 
     return "ok", 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metrics of all workers in Prometheus format."""
+
+    return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    """Hottest stacks of the worker sampled during requested time."""
+
+    status, text = handle_profile_request(
+        request.args.get('token'),
+        request.args.get('seconds'),
+        app.profiler_token,
+    )
+
+    return Response(text, status=status, mimetype='text/plain')
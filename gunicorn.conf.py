@@ -0,0 +1,23 @@
+import glob
+import os
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server):
+    """Drop metrics left by workers of previous launch."""
+
+    metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if not metrics_dir:
+        return
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    for metrics_file in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(metrics_file)
+
+
+def child_exit(server, worker):
+    """Stop reporting live gauges of exited worker."""
+
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
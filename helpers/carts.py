@@ -0,0 +1,147 @@
+import json
+import threading
+from collections import OrderedDict
+
+from api.moltin_requests import (
+    add_product_to_cart,
+    fetch_cart_items,
+    remove_cart_item_by_id,
+)
+from helpers.metrics import cache_lookups
+
+CART_KEY = 'CART_{}'
+
+
+class CartService:
+    """Local mirror of Moltin carts with write-through mutations.
+
+    Every mutation is sent to Moltin and the cart returned in response is
+    stored in mirror, so cart views are rendered without reading Moltin.
+    Mirror is kept in redis if `db` is set, so all processes share it,
+    otherwise in process memory. Cart is read from Moltin only if it's not
+    mirrored yet or on reconciliation before checkout.
+
+    Memory mirror of one process misses mutations made by other ones, so
+    it has to be turned off by `memory_mirror` if several processes serve
+    the same carts without redis, then carts are always read from Moltin.
+
+    Args:
+        db: redis connection or None to keep carts in memory
+        ttl: seconds after which cart of inactive client is dropped
+        maxsize: maximum number of carts kept in memory
+        memory_mirror: whether to mirror carts in memory if `db` is not set
+    """
+
+    def __init__(
+        self,
+        db=None,
+        ttl=24 * 3600,
+        maxsize=10000,
+        memory_mirror=True,
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.memory_mirror = memory_mirror
+
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, cart_name):
+        if self.db is not None:
+            cart = self.db.get(CART_KEY.format(cart_name))
+            return json.loads(cart) if cart else None
+        if not self.memory_mirror:
+            return None
+
+        with self._lock:
+            cart = self._carts.get(cart_name)
+            if cart is not None:
+                self._carts.move_to_end(cart_name)
+
+            return cart
+
+    def _store(self, cart_name, cart):
+        if self.db is not None:
+            self.db.set(
+                CART_KEY.format(cart_name),
+                json.dumps(cart),
+                ex=self.ttl,
+            )
+            return
+        if not self.memory_mirror:
+            return
+
+        with self._lock:
+            self._carts[cart_name] = cart
+            self._carts.move_to_end(cart_name)
+            while len(self._carts) > self.maxsize:
+                self._carts.popitem(last=False)
+
+    def get(self, token, cart_name):
+        """Get cart items from mirror, fetching them if not mirrored yet
+
+        Args:
+            token: authorization token
+            cart_name: name of cart
+
+        Returns:
+            API response containing all cart items
+        """
+        if (cart := self._load(cart_name)) is not None:
+            cache_lookups.labels(cache='carts', result='hit').inc()
+            return cart
+
+        cache_lookups.labels(cache='carts', result='miss').inc()
+        return self.reconcile(token, cart_name)
+
+    def add(self, token, cart_name, product_id, quantity):
+        """Add product to cart
+
+        Args:
+            token: authorization token
+            cart_name: name of cart to add product to
+            product_id: id of product to add to cart
+            quantity: quantity of product to add to cart
+
+        Returns:
+            API response containing all cart items
+        """
+        cart = add_product_to_cart(token, cart_name, product_id, quantity)
+        self._store(cart_name, cart)
+
+        return cart
+
+    def remove(self, token, cart_name, item_id):
+        """Remove item from cart
+
+        Args:
+            token: authorization token
+            cart_name: name of cart to remove item from
+            item_id: id of item to remove from cart
+
+        Returns:
+            API response containing all cart items
+        """
+        cart = remove_cart_item_by_id(token, cart_name, item_id)
+        self._store(cart_name, cart)
+
+        return cart
+
+    def reconcile(self, token, cart_name):
+        """Replace mirrored cart with the one stored in Moltin
+
+        Args:
+            token: authorization token
+            cart_name: name of cart
+
+        Returns:
+            API response containing all cart items
+        """
+        cart = fetch_cart_items(token, cart_name)
+        self._store(cart_name, cart)
+
+        return cart
+
+
+carts = CartService()
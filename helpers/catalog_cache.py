@@ -0,0 +1,268 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from requests.exceptions import RequestException
+
+from api.moltin_async_requests import get_client
+from api.moltin_requests import fetch_product_by_id, fetch_products
+from helpers.metrics import cache_lookups
+from helpers.product_images import get_main_image_id, product_images
+
+CATALOG_VERSION_FILE = 'catalog.version'
+
+
+class CatalogCache:
+    """In-process cache of catalog API responses.
+
+    Entry younger than `ttl` is served as is. Entry younger than `stale_ttl`
+    is served as well, but refreshed in a background thread. Older or
+    missing entry is loaded synchronously, but if API is unavailable (i.e.
+    its circuit is open) outdated entry is served anyway, or fallback value
+    (i.e. one of catalog snapshot) if there is no entry. Cache holds at
+    most `maxsize` entries evicting least recently used ones.
+
+    Touching of version file (see `invalidate_catalog`) drops all entries
+    in every process using the same working directory.
+
+    Args:
+        ttl: seconds during which entry is considered fresh
+        stale_ttl: seconds during which entry may be served while refreshed
+        maxsize: maximum number of cached entries
+        version_file: path to file signalling catalog changes
+    """
+
+    def __init__(
+        self,
+        ttl=300,
+        stale_ttl=3600,
+        maxsize=256,
+        version_file=CATALOG_VERSION_FILE,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.version_file = version_file
+        self.version = 0
+
+        self._entries = OrderedDict()
+        self._fallbacks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._version_mtime = self._read_version_mtime()
+
+    def _read_version_mtime(self):
+        try:
+            return os.stat(self.version_file).st_mtime
+        except OSError:
+            return None
+
+    def _check_version_file(self):
+        version_mtime = self._read_version_mtime()
+        if version_mtime != self._version_mtime:
+            self._version_mtime = version_mtime
+            self.invalidate()
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key, loader):
+        try:
+            self._store(key, loader())
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        threading.Thread(
+            target=self._refresh,
+            args=(key, loader),
+            daemon=True,
+        ).start()
+
+    def get(self, key, loader):
+        """Get cached value or load it
+
+        Args:
+            key: cache key
+            loader: callable without arguments returning fresh value
+
+        Returns:
+            cached or freshly loaded value
+        """
+        self._check_version_file()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+
+        if entry:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                cache_lookups.labels(cache='catalog', result='hit').inc()
+                return value
+            if age < self.stale_ttl:
+                cache_lookups.labels(cache='catalog', result='stale').inc()
+                self._refresh_in_background(key, loader)
+                return value
+
+        try:
+            value = loader()
+        except RequestException:
+            if entry:
+                cache_lookups.labels(cache='catalog', result='fallback').inc()
+                return entry[0]
+            if key in self._fallbacks:
+                cache_lookups.labels(cache='catalog', result='fallback').inc()
+                return self._fallbacks[key]
+            raise
+
+        cache_lookups.labels(cache='catalog', result='miss').inc()
+        self._store(key, value)
+
+        return value
+
+    def set_fallbacks(self, fallbacks):
+        """Set values served when API is unavailable and entry is missing
+
+        Fallbacks are never evicted nor invalidated, they are only replaced
+        by next call.
+
+        Args:
+            fallbacks: dictionary of cache keys and their values
+        """
+        self._fallbacks = dict(fallbacks)
+
+    def invalidate(self, key=None):
+        """Drop one cached entry or the whole cache
+
+        Args:
+            key: cache key to drop, all entries are dropped if not set
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self.version += 1
+
+    def fetch_products(self, auth):
+        """Cached version of `fetch_products`
+
+        Token is requested only if products are loaded from API, so cached
+        or fallback products are served while token can't be fetched.
+
+        Args:
+            auth: token provider, i.e. AuthToken
+
+        Returns:
+            API response containing products
+        """
+        return self.get(
+            'products',
+            lambda: fetch_with_images(fetch_products, auth.token),
+        )
+
+    def fetch_product_by_id(self, auth, product_id):
+        """Cached version of `fetch_product_by_id`
+
+        Args:
+            auth: token provider, i.e. AuthToken
+            product_id: id of product to fetch details of
+
+        Returns:
+            API response containing product details
+        """
+        return self.get(
+            f'product_{product_id}',
+            lambda: fetch_with_images(
+                fetch_product_by_id, auth.token, product_id
+            ),
+        )
+
+
+def fetch_with_images(fetch_function, *args):
+    """Fetch products including their main images
+
+    Image urls found in response are remembered in product images map.
+
+    Args:
+        fetch_function: products fetching function accepting `include`
+        args: arguments of fetching function
+
+    Returns:
+        API response containing products
+    """
+    response = fetch_function(*args, include='main_image')
+    product_images.update_from_response(response)
+
+    return response
+
+
+async def fetch_product_with_image_url(auth, product_id):
+    """Fetch product details and url of its main image concurrently
+
+    Main image id is taken from cached list of products, so the image is
+    resolved while product details are fetched. It's resolved once more
+    only if product details refer to another image.
+
+    Args:
+        auth: token provider, i.e. AuthToken
+        product_id: id of product to fetch details of
+
+    Returns:
+        tuple of API response containing product details and url of
+        product main image or None if product has no image
+    """
+    client = get_client()
+
+    try:
+        products = await client.call(catalog.fetch_products, auth)
+    except RequestException:
+        products = {'data': []}
+
+    listed_product = next(
+        (
+            product
+            for product in products['data']
+            if product['id'] == product_id
+        ),
+        {'id': product_id},
+    )
+
+    product_response, image_url = await asyncio.gather(
+        client.call(catalog.fetch_product_by_id, auth, product_id),
+        client.call(product_images.get_url, auth, listed_product),
+    )
+
+    product = product_response['data']
+    if get_main_image_id(product) != get_main_image_id(listed_product):
+        image_url = await client.call(product_images.get_url, auth, product)
+
+    return product_response, image_url
+
+
+def invalidate_catalog(version_file=CATALOG_VERSION_FILE):
+    """Signal all catalog caches that catalog has changed
+
+    Args:
+        version_file: path to file signalling catalog changes
+    """
+    with open(version_file, 'w') as file:
+        file.write(str(time.time()))
+
+
+catalog = CatalogCache()
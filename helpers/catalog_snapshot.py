@@ -0,0 +1,166 @@
+import logging
+import os
+import tempfile
+import time
+
+import msgpack
+from requests.exceptions import RequestException
+
+from api.moltin_requests import fetch_categories, fetch_products
+from helpers.catalog_cache import catalog, fetch_with_images
+from helpers.product_images import product_images
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT_FILE = 'catalog.snapshot'
+SNAPSHOT_FORMAT = 1
+
+
+def build_catalog_snapshot(token):
+    """Fetch catalog data needed to render menus
+
+    Snapshot keeps products with their prices, categories and image urls,
+    included into products response as main images.
+
+    Args:
+        token: authorization token
+
+    Returns:
+        catalog snapshot dictionary
+    """
+    products = fetch_with_images(fetch_products, token)
+    categories = fetch_categories(token)
+
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'created_at': time.time(),
+        'products': {
+            'data': products['data'],
+            'included': {
+                'main_images': products.get('included', {}).get(
+                    'main_images', []
+                ),
+            },
+        },
+        'categories': {'data': categories['data']},
+    }
+
+
+def write_catalog_snapshot(snapshot, filename=CATALOG_SNAPSHOT_FILE):
+    """Atomically write catalog snapshot to msgpack file
+
+    Args:
+        snapshot: catalog snapshot dictionary
+        filename: path to snapshot file
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    with tempfile.NamedTemporaryFile(
+        'wb',
+        dir=directory,
+        delete=False,
+    ) as snapshot_file:
+        snapshot_file.write(msgpack.packb(snapshot, use_bin_type=True))
+    os.replace(snapshot_file.name, filename)
+
+
+def load_catalog_snapshot(filename=CATALOG_SNAPSHOT_FILE):
+    """Load catalog snapshot from msgpack file
+
+    Args:
+        filename: path to snapshot file
+
+    Returns:
+        catalog snapshot dictionary or None if file is missing or broken
+    """
+    try:
+        with open(filename, 'rb') as snapshot_file:
+            snapshot = msgpack.unpackb(snapshot_file.read(), raw=False)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(snapshot, dict):
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        return None
+
+    return snapshot
+
+
+def get_category_products(snapshot, category_id):
+    """Get products of category kept in catalog snapshot
+
+    Args:
+        snapshot: catalog snapshot dictionary
+        category_id: id of category
+
+    Returns:
+        list of products related to category
+    """
+    return [
+        product
+        for product in snapshot['products']['data']
+        if any(
+            category['id'] == category_id
+            for category in product.get('relationships', {})
+            .get('categories', {})
+            .get('data', [])
+        )
+    ]
+
+
+def seed_catalog(snapshot, cache=catalog):
+    """Make catalog cache serve snapshot while API is unavailable
+
+    Image urls of snapshot are remembered in product images map as well.
+
+    Args:
+        snapshot: catalog snapshot dictionary
+        cache: catalog cache to seed
+    """
+    products = snapshot['products']
+
+    fallbacks = {'products': products}
+    for product in products['data']:
+        fallbacks[f'product_{product["id"]}'] = {'data': product}
+    cache.set_fallbacks(fallbacks)
+
+    product_images.update_from_response(products)
+
+
+def load_and_seed_catalog(filename=CATALOG_SNAPSHOT_FILE):
+    """Seed catalog cache with snapshot saved by previous run, if any
+
+    Args:
+        filename: path to snapshot file
+
+    Returns:
+        loaded catalog snapshot dictionary or None
+    """
+    if snapshot := load_catalog_snapshot(filename):
+        seed_catalog(snapshot)
+
+    return snapshot
+
+
+def save_catalog_snapshot(token, filename=CATALOG_SNAPSHOT_FILE):
+    """Fetch, write and seed fresh catalog snapshot
+
+    Failure to reach API is logged, previous snapshot is kept then.
+
+    Args:
+        token: authorization token
+        filename: path to snapshot file
+
+    Returns:
+        fresh catalog snapshot dictionary or None if API is unavailable
+    """
+    try:
+        snapshot = build_catalog_snapshot(token)
+    except RequestException:
+        logger.warning('Catalog snapshot is not refreshed', exc_info=True)
+        return None
+
+    write_catalog_snapshot(snapshot, filename)
+    seed_catalog(snapshot)
+
+    return snapshot
@@ -1,9 +1,14 @@
+import asyncio
 import textwrap
 
 from geopy import distance
 
-from api.moltin_requests import fetch_cart_items, fetch_entries
+from api.moltin_async_requests import get_client
+from helpers.carts import carts
+from helpers.pizzerias import pizzerias
+from helpers.tg_send_queue import PRIORITY_MARKETING, get_send_queue
 
+NEAREST_CANDIDATES_COUNT = 3
 
 NOTIFICATION_ABOUT_PIZZA = textwrap.dedent(
     f"""
@@ -35,6 +40,9 @@ def calculate_delivery_cost(distance):
 def find_nearest_pizzeria(auth_token, client_coordinates):
     """Finds the closest pizzeria in terms of distance to the client
 
+    Pizzerias nearest on spatial index of local pizzerias registry are
+    refined with exact geodesic distance.
+
     Args:
         auth_token (str): authentication token
         client_coordinates (tuple): client current coordinates (lat, lon)
@@ -42,40 +50,65 @@ def find_nearest_pizzeria(auth_token, client_coordinates):
     Returns:
         dict: essential info about nearest pizzeria
     """
-    fetched_pizzerias = fetch_entries(auth_token, 'pizzeria')
+    pizzerias.ensure_loaded(auth_token)
 
-    pizzerias_with_distances = [
-        dict(
-            **pizzeria,
-            **{
-                'distance': distance.distance(
-                    client_coordinates,
-                    (pizzeria['latitude'], pizzeria['longitude']),
-                ).kilometers
-            },
-        )
-        for pizzeria in fetched_pizzerias['data']
-    ]
-
-    nearest_pizzeria = min(
-        pizzerias_with_distances,
-        key=lambda x: x['distance'],
+    candidates = pizzerias.nearest(
+        client_coordinates,
+        count=NEAREST_CANDIDATES_COUNT,
     )
 
-    attibutes_to_keep = ('address', 'distance', 'deliveryman_telegram_id')
+    nearest_pizzeria, nearest_distance = min(
+        (
+            (
+                pizzeria,
+                distance.distance(
+                    client_coordinates,
+                    (pizzeria.latitude, pizzeria.longitude),
+                ).kilometers,
+            )
+            for pizzeria in candidates
+        ),
+        key=lambda x: x[1],
+    )
 
-    pizzeria_essential_info = {
-        pizzeria_attribute: attribute_value
-        for pizzeria_attribute, attribute_value in nearest_pizzeria.items()
-        if pizzeria_attribute in attibutes_to_keep
+    return {
+        'address': nearest_pizzeria.address,
+        'distance': nearest_distance,
+        'deliveryman_telegram_id': nearest_pizzeria.deliveryman_telegram_id,
     }
 
-    return pizzeria_essential_info
+
+async def prepare_checkout(auth_token, cart_name, client_coordinates):
+    """Find nearest pizzeria and reconcile cart concurrently
+
+    Pizzeria entries are loaded from Moltin if they are not loaded yet
+    while cart mirror is reconciled with Moltin before the invoice.
+
+    Args:
+        auth_token (str): authentication token
+        cart_name (str): name of client cart
+        client_coordinates (tuple): client current coordinates (lat, lon)
+
+    Returns:
+        tuple: nearest pizzeria info, see `find_nearest_pizzeria`, and
+        reconciled cart
+    """
+    client = get_client()
+
+    return tuple(
+        await asyncio.gather(
+            client.call(find_nearest_pizzeria, auth_token, client_coordinates),
+            client.call(carts.reconcile, auth_token, cart_name),
+        )
+    )
 
 
 def get_order_details_for_invoice(cart_id, context):
     """Gets order details for payment invoice
 
+    Cart mirror is reconciled with Moltin once delivery address is known,
+    see `prepare_checkout`.
+
     Args:
         cart_id (str): id of client cart
         context: bot context
@@ -85,7 +118,7 @@ def get_order_details_for_invoice(cart_id, context):
     """
     auth_token = context.bot_data['auth_token'].token
 
-    cart = fetch_cart_items(auth_token, f'pizza_{cart_id}')
+    cart = carts.get(auth_token, f'pizza_{cart_id}')
 
     order_details = ''.join(
         '{}: {} шт; '.format(cart_item['name'], cart_item['quantity'])
@@ -101,7 +134,10 @@ def notify_about_pizza(context):
     Args:
         context: bot context
     """
-    context.bot.send_message(
+    get_send_queue().submit(
+        context.job.context,
+        context.bot.send_message,
         context.job.context,
-        message=NOTIFICATION_ABOUT_PIZZA,
+        text=NOTIFICATION_ABOUT_PIZZA,
+        priority=PRIORITY_MARKETING,
     )
@@ -1,22 +1,45 @@
+import hashlib
 import json
 
-from api.moltin_requests import (
-    add_product_to_cart,
-    fetch_categories,
-    remove_cart_item_by_id,
-)
+from api.moltin_requests import fetch_categories
+from helpers.carts import carts
+from helpers.catalog_snapshot import get_category_products
 from helpers.fb_chat_replying import send_items, send_message
-from helpers.fb_items_formatters import get_formatted_menu
+from helpers.fb_items_formatters import (
+    fetch_category_products,
+    format_menu,
+    get_product_fingerprint,
+)
+
+# formatted menu elements by product fingerprints, shared by menu rebuilds
+_menu_elements = {}
+
+
+def get_event_type(message, payload):
+    if message:
+        return 'message'
 
+    if not payload:
+        # stickers, attachments and likes have neither text nor payload
+        return 'unsupported'
 
-def handle_user_input(db, state, user_id, auth, fb_token, message, payload):
+    for prefix in ('CATEGORY', 'ADD_TO_CART', 'REMOVE_FROM_CART'):
+        if payload.startswith(prefix):
+            return prefix
+
+    return payload
+
+
+def handle_user_input(
+    menus, state, user_id, auth, fb_token, message, payload
+):
     if state == 'MENU' and message:
-        send_items(user_id, auth, fb_token, 'menu', db, 'front_page')
+        send_items(user_id, auth, fb_token, 'menu', menus, 'front_page')
         return state
 
     if payload and 'CATEGORY' in payload and state == 'MENU':
         category_slug = payload.replace('CATEGORY_', '')
-        send_items(user_id, auth, fb_token, 'menu', db, category_slug)
+        send_items(user_id, auth, fb_token, 'menu', menus, category_slug)
         return state
 
     if payload and 'ADD' in payload and state == 'MENU':
@@ -38,7 +61,7 @@ def handle_user_input(db, state, user_id, auth, fb_token, message, payload):
         return 'CART'
 
     if payload == 'BACK_TO_MENU' and state == 'CART':
-        send_items(user_id, auth, fb_token, 'menu', db, 'front_page')
+        send_items(user_id, auth, fb_token, 'menu', menus, 'front_page')
         return 'MENU'
 
 
@@ -46,7 +69,7 @@ def handle_adding_to_cart(payload, user_id, auth, fb_token):
     payload = payload.replace('ADD_TO_CART_', '')
     product_id, product_name = payload.split('_')
 
-    add_product_to_cart(auth.token, f'fb_pizza_{user_id}', product_id, 1)
+    carts.add(auth.token, f'fb_pizza_{user_id}', product_id, 1)
     message = f'В корзину добавлена {product_name}'
     send_message(user_id, message, fb_token)
 
@@ -55,15 +78,64 @@ def handle_removing_from_cart(payload, user_id, auth, fb_token):
     payload = payload.replace('REMOVE_FROM_CART_', '')
     product_id, product_name = payload.split('_')
 
-    remove_cart_item_by_id(auth.token, f'fb_pizza_{user_id}', product_id)
+    carts.remove(auth.token, f'fb_pizza_{user_id}', product_id)
 
     message = f'{product_name} убрана из корзины'
     send_message(user_id, message, fb_token)
 
 
-def handle_menu_caching(auth, db):
-    categories = fetch_categories(auth.token)['data']
+def handle_menu_caching(auth, db, snapshot=None):
+    if snapshot:
+        categories = snapshot['categories']['data']
+    else:
+        categories = fetch_categories(auth.token)['data']
+    categories_fingerprint = [
+        (category['id'], category['slug'], category['name'])
+        for category in categories
+    ]
+
+    slugs = [category['slug'] for category in categories]
+    stored_hashes = dict(
+        zip(slugs, db.mget([f'MENU_HASH_{slug}' for slug in slugs]))
+    )
+
+    changed_menus = {}
+    actual_fingerprints = set()
     for category in categories:
         slug = category['slug']
-        menu = get_formatted_menu(auth, categories, slug)
-        db.set(slug, json.dumps(menu))
+        if snapshot:
+            products = get_category_products(snapshot, category['id'])
+        else:
+            products = fetch_category_products(auth, category['id'])
+
+        products_fingerprints = [
+            get_product_fingerprint(product) for product in products
+        ]
+        actual_fingerprints.update(products_fingerprints)
+
+        menu_hash = hashlib.sha1(
+            json.dumps([categories_fingerprint, products_fingerprints]).encode()
+        ).hexdigest()
+
+        if stored_hashes.get(slug) == menu_hash.encode():
+            continue
+
+        other_categories = [
+            other_category
+            for other_category in categories
+            if other_category['id'] != category['id']
+        ]
+        menu = format_menu(auth, products, other_categories, _menu_elements)
+        changed_menus[slug] = (json.dumps(menu), menu_hash)
+
+    for fingerprint in set(_menu_elements) - actual_fingerprints:
+        del _menu_elements[fingerprint]
+
+    if not changed_menus:
+        return
+
+    pipeline = db.pipeline(transaction=True)
+    for slug, (menu, menu_hash) in changed_menus.items():
+        pipeline.set(slug, menu)
+        pipeline.set(f'MENU_HASH_{slug}', menu_hash)
+    pipeline.execute()
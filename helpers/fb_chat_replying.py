@@ -2,16 +2,26 @@ import json
 
 import requests
 
+from api.resilience import get_endpoint
 from helpers.fb_items_formatters import get_formatted_cart
+from helpers.metrics import track_upstream_call
+from helpers.view_cache import views
+
+GRAPH_API_URL = 'https://graph.facebook.com'
 
 
 def send_items(
-    user_id, auth, fb_token, items_type, db=None, category_slug=None
+    user_id, auth, fb_token, items_type, menus=None, category_slug=None
 ):
     if items_type == 'cart':
         items = get_formatted_cart(auth, user_id)
     else:
-        items = json.loads(db.get(category_slug).decode())
+        menu = menus[category_slug]
+        items = views.get(
+            f'fb_menu_{category_slug}',
+            menu,
+            lambda: json.loads(menu.decode()),
+        )
 
     params = {'access_token': fb_token}
     headers = {'Content-Type': 'application/json'}
@@ -29,13 +39,7 @@ def send_items(
         },
     }
 
-    response = requests.post(
-        'https://graph.facebook.com/v2.6/me/messages',
-        headers=headers,
-        params=params,
-        json=request_content,
-    )
-    response.raise_for_status()
+    send_api_request(params, headers, request_content)
 
 
 def send_message(user_id, message_text, fb_token):
@@ -45,10 +49,18 @@ def send_message(user_id, message_text, fb_token):
         'recipient': {'id': user_id},
         'message': {'text': message_text},
     }
-    response = requests.post(
-        'https://graph.facebook.com/v2.6/me/messages',
-        params=params,
-        headers=headers,
-        json=request_content,
-    )
+    send_api_request(params, headers, request_content)
+
+
+def send_api_request(params, headers, request_content):
+    url = f'{GRAPH_API_URL}/v2.6/me/messages'
+
+    with track_upstream_call(get_endpoint(url), 'POST') as call:
+        response = requests.post(
+            url,
+            params=params,
+            headers=headers,
+            json=request_content,
+        )
+        call['status'] = response.status_code
     response.raise_for_status()
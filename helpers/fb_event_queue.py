@@ -0,0 +1,238 @@
+import json
+import logging
+import threading
+import zlib
+
+from prometheus_client.core import GaugeMetricFamily
+from redis.exceptions import LockError, LockNotOwnedError, RedisError
+
+logger = logging.getLogger(__name__)
+
+EVENTS_KEY = 'FB_EVENTS_{}'
+PROCESSING_EVENTS_KEY = 'FB_EVENTS_PROCESSING_{}'
+PARTITION_LOCK_KEY = 'FB_EVENTS_LOCK_{}'
+
+# moves up to ARGV[1] events from queue KEYS[1] to processing list KEYS[2]
+MOVE_EVENTS_SCRIPT = """
+local events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #events > 0 then
+    redis.call('LTRIM', KEYS[1], #events, -1)
+    redis.call('RPUSH', KEYS[2], unpack(events))
+end
+return events
+"""
+
+
+def get_partition(user_id, partitions):
+    """Get number of queue partition of user events
+
+    Args:
+        user_id: facebook id of message sender
+        partitions: total number of queue partitions
+
+    Returns:
+        number of partition
+    """
+    return zlib.crc32(str(user_id).encode()) % partitions
+
+
+def enqueue_events(db, events, partitions):
+    """Push messaging events to redis queue partitioned by sender
+
+    Args:
+        db: redis connection
+        events: facebook messaging events
+        partitions: total number of queue partitions
+    """
+    pipeline = db.pipeline(transaction=False)
+    for event in events:
+        partition = get_partition(event['sender']['id'], partitions)
+        pipeline.rpush(EVENTS_KEY.format(partition), json.dumps(event))
+    pipeline.execute()
+
+
+class QueueDepthCollector:
+    """Prometheus collector of lengths of all partitions of events queue.
+
+    Lengths are read from redis on every scrape, so any process serving
+    metrics reports the same values.
+
+    Args:
+        db: redis connection
+        partitions: total number of queue partitions
+    """
+
+    def __init__(self, db, partitions):
+        self.db = db
+        self.partitions = partitions
+
+    def _get_metric(self):
+        return GaugeMetricFamily(
+            'pizza_bot_fb_queue_depth',
+            'Number of facebook events waiting in queue by partition.',
+            labels=['partition'],
+        )
+
+    def describe(self):
+        return [self._get_metric()]
+
+    def collect(self):
+        pipeline = self.db.pipeline(transaction=False)
+        for partition in range(self.partitions):
+            pipeline.llen(EVENTS_KEY.format(partition))
+
+        try:
+            depths = pipeline.execute()
+        except RedisError:
+            logger.exception('Failed to get queue depth')
+            return []
+
+        metric = self._get_metric()
+        for partition, depth in enumerate(depths):
+            metric.add_metric([str(partition)], depth)
+
+        return [metric]
+
+
+class EventWorker(threading.Thread):
+    """Thread draining one partition of events queue.
+
+    Events are taken in batches of up to `batch_size` events, so their
+    processing can share round-trips to redis. Taken events are moved to
+    processing list of partition and removed from it only after the batch
+    is processed, so events taken by a crashed worker are processed again
+    by the next one.
+
+    Partition is drained by a single worker across all processes: worker
+    holds partition lock while draining and renews it after every event.
+    Lock of a dead worker expires after `lease` seconds and partition is
+    taken over by a worker of another process, so events of one sender are
+    always processed in order. Worker which lost its lock stops draining
+    until it acquires the lock again.
+
+    Args:
+        db: redis connection, redis 6.2 or newer is required
+        partition: number of drained partition
+        process_events: callable processing list of events, accepting
+            `heartbeat` callable to be called after every event
+        batch_size: maximum number of events processed at once
+        lease: seconds after which lock of dead worker expires
+        poll_timeout: seconds to wait for event or lock
+    """
+
+    def __init__(
+        self,
+        db,
+        partition,
+        process_events,
+        batch_size=50,
+        lease=30,
+        poll_timeout=1,
+    ):
+        super().__init__(name=f'fb_event_worker_{partition}', daemon=True)
+        self.db = db
+        self.partition = partition
+        self.process_events = process_events
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_timeout = poll_timeout
+        self.stopped = threading.Event()
+
+        self.events_key = EVENTS_KEY.format(partition)
+        self.processing_key = PROCESSING_EVENTS_KEY.format(partition)
+        self._move_events = db.register_script(MOVE_EVENTS_SCRIPT)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self._drain_while_locked()
+            except LockNotOwnedError:
+                logger.warning('Partition %s lock is lost', self.partition)
+            except RedisError:
+                logger.exception('Partition %s worker failed', self.partition)
+                self.stopped.wait(self.poll_timeout)
+
+    def _drain_while_locked(self):
+        lock = self.db.lock(
+            PARTITION_LOCK_KEY.format(self.partition),
+            timeout=self.lease,
+        )
+        if not lock.acquire(blocking=False):
+            self.stopped.wait(self.poll_timeout)
+            return
+
+        try:
+            while not self.stopped.is_set():
+                self._process_next_events(lock)
+                lock.reacquire()
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                pass
+
+    def _take_events(self):
+        # events left by a worker which died or lost its lock go first
+        events = self.db.lrange(self.processing_key, 0, -1)
+        if events:
+            return events
+
+        event = self.db.blmove(
+            self.events_key,
+            self.processing_key,
+            self.poll_timeout,
+            'LEFT',
+            'RIGHT',
+        )
+        if event is None:
+            return []
+
+        return [
+            event,
+            *self._move_events(
+                keys=[self.events_key, self.processing_key],
+                args=[self.batch_size - 1],
+            ),
+        ]
+
+    def _process_next_events(self, lock):
+        events = self._take_events()
+        if not events:
+            return
+
+        try:
+            self.process_events(
+                [json.loads(event) for event in events],
+                heartbeat=lock.reacquire,
+            )
+        except RedisError:
+            # batch stays in processing list and is taken again
+            raise
+        except Exception:
+            logger.exception('Failed to process events %s', events)
+
+        self.db.ltrim(self.processing_key, len(events), -1)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_event_workers(db, process_events, partitions):
+    """Start workers for all partitions of events queue
+
+    Args:
+        db: redis connection
+        process_events: callable processing list of events, see `EventWorker`
+        partitions: total number of queue partitions
+
+    Returns:
+        list of started workers
+    """
+    workers = [
+        EventWorker(db, partition, process_events)
+        for partition in range(partitions)
+    ]
+    for worker in workers:
+        worker.start()
+
+    return workers
@@ -1,39 +1,63 @@
-from api.moltin_requests import (
-    fetch_cart_items,
-    fetch_image_by_id,
-    fetch_products_by_category_id,
-)
+import hashlib
+import json
 
+from api.moltin_requests import fetch_products_by_category_id
+from helpers.carts import carts
+from helpers.product_images import get_main_image_id, product_images
 
-def get_formatted_menu(auth, categories, slug):
-    displaying_category = next(
-        filter(lambda category: category['slug'] == slug, categories)
-    )
-    category_id = displaying_category.get('id')
 
-    other_categories = list(
-        filter(lambda category: category['id'] != category_id, categories)
+def fetch_category_products(auth, category_id):
+    products_response = fetch_products_by_category_id(
+        auth.token,
+        category_id,
+        include='main_image',
     )
+    product_images.update_from_response(products_response)
+
+    return products_response['data']
+
+
+def get_product_fingerprint(product):
+    timestamps = product.get('meta', {}).get('timestamps', {})
+    if updated_at := timestamps.get('updated_at'):
+        fingerprint_source = [
+            product['id'],
+            updated_at,
+            get_main_image_id(product),
+        ]
+    else:
+        fingerprint_source = product
+
+    return hashlib.sha1(
+        json.dumps(fingerprint_source, sort_keys=True).encode()
+    ).hexdigest()
 
-    products = fetch_products_by_category_id(auth.token, category_id)['data']
 
-    menu = [
+def format_menu(auth, products, other_categories, elements_cache=None):
+    if elements_cache is None:
+        elements_cache = {}
+
+    product_elements = []
+    for product in products:
+        fingerprint = get_product_fingerprint(product)
+        if fingerprint not in elements_cache:
+            elements_cache[fingerprint] = format_menu_element(product, auth)
+        product_elements.append(elements_cache[fingerprint])
+
+    return [
         format_first_menu_element(),
-        *[format_menu_element(product, auth) for product in products],
+        *product_elements,
         format_last_menu_element(other_categories),
     ]
 
-    return menu
-
 
 def format_menu_element(product, auth):
     product_price = product['meta']['display_price']['without_tax']['amount']
-    product_image_id = product['relationships']['main_image']['data']['id']
-    product_image = fetch_image_by_id(auth.token, product_image_id)['data']
+    product_image_url = product_images.get_url(auth, product)
 
     return {
         'title': f'{product["name"]} ({product_price} р.)',
-        'image_url': product_image['link']['href'],
+        'image_url': product_image_url,
         'subtitle': product['description'],
         'buttons': [
             {
@@ -89,7 +113,7 @@ def format_last_menu_element(categories):
 
 
 def get_formatted_cart(auth, recepient_id):
-    cart = fetch_cart_items(auth.token, f'fb_pizza_{recepient_id}')
+    cart = carts.get(auth.token, f'fb_pizza_{recepient_id}')
 
     cart_items_formatted = [format_cart_element(item) for item in cart['data']]
 
@@ -0,0 +1,183 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from api.yandex_api_requests import fetch_coordinates
+from helpers.metrics import cache_lookups
+
+GEOCODE_CACHE_FILE = 'geocode_cache.sqlite3'
+
+ADDRESS_ABBREVIATIONS = {
+    'г': 'город',
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'наб': 'набережная',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'д': 'дом',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+}
+
+
+def normalize_address(address):
+    """Normalize address text to be used as cache key
+
+    Args:
+        address: address typed by client
+
+    Returns:
+        address folded to lower case, without punctuation and with
+        expanded abbreviations
+    """
+    address = address.casefold().replace('ё', 'е')
+    words = re.split(r'[\s.,;]+', address)
+
+    return ' '.join(
+        ADDRESS_ABBREVIATIONS.get(word, word) for word in words if word
+    )
+
+
+class GeocodeCache:
+    """Two-tier cache of geocoded addresses.
+
+    Memory tier keeps at most `maxsize` least recently used addresses, disk
+    tier keeps everything in SQLite database. Addresses not found by
+    geocoder are cached as well, but for shorter `negative_ttl`.
+
+    Args:
+        filename: path to SQLite database file
+        maxsize: maximum number of addresses kept in memory
+        ttl: seconds during which found coordinates are cached
+        negative_ttl: seconds during which not found address is cached
+    """
+
+    def __init__(
+        self,
+        filename=GEOCODE_CACHE_FILE,
+        maxsize=1024,
+        ttl=30 * 24 * 3600,
+        negative_ttl=24 * 3600,
+    ):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filename,
+                check_same_thread=False,
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocodes ('
+                'address TEXT PRIMARY KEY, latitude TEXT, longitude TEXT, '
+                'expires_at REAL)'
+            )
+
+        return self._connection
+
+    def _remember(self, key, coordinates, expires_at):
+        self._memory[key] = (coordinates, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, address):
+        """Get cached coordinates of address
+
+        Args:
+            address: address typed by client
+
+        Returns:
+            tuple (lat, lon), (None, None) for address known to be not
+            found, or None if address is not cached
+        """
+        key = normalize_address(address)
+        now = time.time()
+
+        with self._lock:
+            if entry := self._memory.get(key):
+                coordinates, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    return coordinates
+                del self._memory[key]
+
+            row = (
+                self._connect()
+                .execute(
+                    'SELECT latitude, longitude, expires_at FROM geocodes '
+                    'WHERE address = ?',
+                    (key,),
+                )
+                .fetchone()
+            )
+            if not row or row[2] <= now:
+                return None
+
+            coordinates = (row[0], row[1])
+            self._remember(key, coordinates, row[2])
+
+            return coordinates
+
+    def set(self, address, coordinates):
+        """Cache coordinates of address
+
+        Args:
+            address: address typed by client
+            coordinates: tuple (lat, lon) or (None, None) if not found
+        """
+        key = normalize_address(address)
+        ttl = self.negative_ttl if None in coordinates else self.ttl
+        expires_at = time.time() + ttl
+
+        with self._lock:
+            self._remember(key, tuple(coordinates), expires_at)
+
+            connection = self._connect()
+            connection.execute(
+                'INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)',
+                (key, *coordinates, expires_at),
+            )
+            connection.commit()
+
+
+def fetch_coordinates_cached(apikey, address, cache=None):
+    """Fetch coordinates with yandex api unless they are cached
+
+    Args:
+        apikey: yandex api token
+        address: address to fetch coordinates for
+        cache: geocode cache, shared one is used if not set
+
+    Returns:
+        tuple containing coordinates or (None, None)
+    """
+    cache = cache or geocode_cache
+
+    if (coordinates := cache.get(address)) is not None:
+        cache_lookups.labels(cache='geocode', result='hit').inc()
+        return coordinates
+
+    cache_lookups.labels(cache='geocode', result='miss').inc()
+    coordinates = fetch_coordinates(apikey, address)
+    cache.set(address, coordinates)
+
+    return coordinates
+
+
+geocode_cache = GeocodeCache()
@@ -0,0 +1,242 @@
+import contextlib
+import functools
+import itertools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from helpers.profiler import handle_profile_request
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# collectors of state shared by all processes, i.e. redis queues, run on
+# scrape by whichever process serves it
+shared_registry = CollectorRegistry()
+
+handler_duration = Histogram(
+    'pizza_bot_handler_duration_seconds',
+    'Duration of update handlers.',
+    ['bot', 'handler'],
+)
+handlers_in_flight = Gauge(
+    'pizza_bot_handlers_in_flight',
+    'Number of update handlers running now.',
+    ['bot', 'handler'],
+    multiprocess_mode='livesum',
+)
+upstream_duration = Histogram(
+    'pizza_bot_upstream_duration_seconds',
+    'Duration of upstream API calls.',
+    ['endpoint', 'method'],
+)
+upstream_responses = Counter(
+    'pizza_bot_upstream_responses_total',
+    'Upstream API calls by response status, error if there is no response.',
+    ['endpoint', 'method', 'status'],
+)
+upstream_in_flight = Gauge(
+    'pizza_bot_upstream_in_flight',
+    'Number of upstream API calls waiting for response now.',
+    ['endpoint'],
+    multiprocess_mode='livesum',
+)
+cache_lookups = Counter(
+    'pizza_bot_cache_lookups_total',
+    'Cache lookups by result: hit, stale, miss or fallback.',
+    ['cache', 'result'],
+)
+
+
+def register_shared_collector(collector):
+    """Register collector of state shared by all processes
+
+    Collector is called on every scrape, see `render_metrics`.
+
+    Args:
+        collector: prometheus collector, i.e. one reading redis
+    """
+    shared_registry.register(collector)
+
+
+def render_metrics():
+    """Render metrics in Prometheus text format
+
+    If `PROMETHEUS_MULTIPROC_DIR` is set, i.e. for gunicorn workers,
+    metrics of all processes writing to that directory are aggregated.
+    Otherwise only metrics of the current process are rendered.
+
+    Returns:
+        metrics exposition bytes
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry) + generate_latest(shared_registry)
+
+
+@contextlib.contextmanager
+def track_handler(bot, handler):
+    """Measure duration of handler and count it as in flight meanwhile
+
+    Args:
+        bot: name of bot, i.e. tg
+        handler: name of handler
+    """
+    handlers_in_flight.labels(bot=bot, handler=handler).inc()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        handler_duration.labels(bot=bot, handler=handler).observe(
+            time.perf_counter() - started_at
+        )
+        handlers_in_flight.labels(bot=bot, handler=handler).dec()
+
+
+def instrumented(bot):
+    """Decorator making handler tracked under its name
+
+    Args:
+        bot: name of bot, i.e. fb
+
+    Returns:
+        handler decorator
+    """
+    return functools.partial(instrument_handler, bot)
+
+
+def instrument_handler(bot, callback):
+    """Wrap handler callback to be tracked under its name
+
+    Args:
+        bot: name of bot, i.e. tg
+        callback: handler callback
+
+    Returns:
+        wrapped callback
+    """
+
+    @functools.wraps(callback)
+    def instrumented_callback(*args, **kwargs):
+        with track_handler(bot, callback.__name__):
+            return callback(*args, **kwargs)
+
+    return instrumented_callback
+
+
+def instrument_conversation(conversation_handler, bot):
+    """Make all handlers of conversation tracked under their names
+
+    Args:
+        conversation_handler: telegram conversation handler
+        bot: name of bot, i.e. tg
+    """
+    handlers = [
+        *conversation_handler.entry_points,
+        *itertools.chain.from_iterable(conversation_handler.states.values()),
+        *conversation_handler.fallbacks,
+    ]
+    for handler in handlers:
+        handler.callback = instrument_handler(bot, handler.callback)
+
+
+@contextlib.contextmanager
+def track_upstream_call(endpoint, method):
+    """Measure duration of upstream API call and count it as in flight
+
+    Caller sets `status` key of yielded dictionary to response status.
+
+    Args:
+        endpoint: name of endpoint, see `api.resilience.get_endpoint`
+        method: HTTP method
+    """
+    call = {'status': 'error'}
+    upstream_in_flight.labels(endpoint=endpoint).inc()
+    started_at = time.perf_counter()
+    try:
+        yield call
+    finally:
+        upstream_duration.labels(endpoint=endpoint, method=method).observe(
+            time.perf_counter() - started_at
+        )
+        upstream_responses.labels(
+            endpoint=endpoint,
+            method=method,
+            status=call['status'],
+        ).inc()
+        upstream_in_flight.labels(endpoint=endpoint).dec()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    profiler_token = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/metrics':
+            self._reply(200, render_metrics(), CONTENT_TYPE)
+        elif url.path == '/debug/profile':
+            status, text = handle_profile_request(
+                params.get('token', [None])[0],
+                params.get('seconds', [None])[0],
+                self.profiler_token,
+            )
+            self._reply(status, text)
+        else:
+            self._reply(404, 'Not found')
+
+    def _reply(self, status, body, content_type='text/plain; charset=utf-8'):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0', profiler_token=None):
+    """Serve /metrics and /debug/profile endpoints in a daemon thread
+
+    Args:
+        port: port to listen on
+        host: interface to listen on
+        profiler_token: secret token enabling profiling endpoint
+
+    Returns:
+        started HTTP server
+    """
+    handler_class = type(
+        'ConfiguredMetricsRequestHandler',
+        (MetricsRequestHandler,),
+        {'profiler_token': profiler_token},
+    )
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever,
+        name='metrics_server',
+        daemon=True,
+    ).start()
+
+    return server
@@ -0,0 +1,104 @@
+import heapq
+import math
+
+
+def to_unit_vector(latitude, longitude):
+    """Convert geographic coordinates to point on unit sphere
+
+    Args:
+        latitude: latitude in degrees
+        longitude: longitude in degrees
+
+    Returns:
+        tuple: cartesian coordinates (x, y, z) of the point
+    """
+    latitude = math.radians(float(latitude))
+    longitude = math.radians(float(longitude))
+
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+def squared_distance(point, other_point):
+    return sum((a - b) ** 2 for a, b in zip(point, other_point))
+
+
+class PizzeriaIndex:
+    """KD-tree of pizzerias placed on unit sphere.
+
+    Straight-line (chord) distance between points of sphere grows together
+    with distance along the sphere surface, so the nearest points of the
+    tree are the nearest pizzerias up to difference between sphere and
+    Earth ellipsoid. That's why several candidates should be refined with
+    exact geodesic distance.
+
+    Args:
+        pizzerias: pizzerias records having latitude and longitude
+    """
+
+    def __init__(self, pizzerias):
+        points = [
+            (
+                to_unit_vector(pizzeria.latitude, pizzeria.longitude),
+                pizzeria,
+            )
+            for pizzeria in pizzerias
+        ]
+        self.size = len(points)
+        self._root = self._build(points, depth=0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        point, pizzeria = points[median]
+
+        return (
+            point,
+            pizzeria,
+            axis,
+            self._build(points[:median], depth + 1),
+            self._build(points[median + 1:], depth + 1),
+        )
+
+    def nearest(self, coordinates, count=1):
+        """Find pizzerias nearest to given coordinates
+
+        Args:
+            coordinates: (latitude, longitude) of the searched place
+            count: number of pizzerias to find
+
+        Returns:
+            list: pizzerias ordered from the nearest one
+        """
+        target = to_unit_vector(*coordinates)
+        found = []
+
+        def search(node):
+            if node is None:
+                return
+
+            point, pizzeria, axis, left, right = node
+            distance = squared_distance(point, target)
+            candidate = (-distance, id(pizzeria), pizzeria)
+            if len(found) < count:
+                heapq.heappush(found, candidate)
+            elif distance < -found[0][0]:
+                heapq.heapreplace(found, candidate)
+
+            axis_difference = target[axis] - point[axis]
+            near, far = (left, right) if axis_difference < 0 else (right, left)
+
+            search(near)
+            if len(found) < count or axis_difference**2 < -found[0][0]:
+                search(far)
+
+        search(self._root)
+
+        return [pizzeria for _, _, pizzeria in sorted(found, reverse=True)]
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import namedtuple
+
+from api.moltin_requests import fetch_all_entries
+from helpers.pizzeria_index import PizzeriaIndex
+
+Pizzeria = namedtuple(
+    'Pizzeria',
+    [
+        'id',
+        'alias',
+        'address',
+        'latitude',
+        'longitude',
+        'deliveryman_telegram_id',
+    ],
+)
+
+
+def to_pizzeria(entry):
+    """Make compact pizzeria record from flow entry
+
+    Args:
+        entry: pizzeria flow entry
+
+    Returns:
+        Pizzeria record
+    """
+    return Pizzeria(
+        id=entry['id'],
+        alias=entry.get('alias'),
+        address=entry.get('address'),
+        latitude=float(entry['latitude']),
+        longitude=float(entry['longitude']),
+        deliveryman_telegram_id=entry.get('deliveryman_telegram_id'),
+    )
+
+
+class PizzeriaRegistry:
+    """In-memory table of pizzerias loaded from Moltin flow.
+
+    All pages of flow entries are loaded at once. Table is reloaded
+    synchronously on first use and in a background thread when it's older
+    than `refresh_interval`. Every reload with changed content increments
+    `version`.
+
+    Args:
+        flow_slug: slug of flow storing pizzerias
+        refresh_interval: seconds after which table is reloaded
+    """
+
+    def __init__(self, flow_slug='pizzeria', refresh_interval=3600):
+        self.flow_slug = flow_slug
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self.loaded_at = None
+
+        self._pizzerias = ()
+        self._by_id = {}
+        self._index = PizzeriaIndex([])
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self, token):
+        """Reload pizzerias from API
+
+        Args:
+            token: authorization token
+        """
+        entries = fetch_all_entries(token, self.flow_slug)
+        pizzerias = tuple(to_pizzeria(entry) for entry in entries)
+
+        with self._lock:
+            if pizzerias != self._pizzerias:
+                self._pizzerias = pizzerias
+                self._by_id = {pizzeria.id: pizzeria for pizzeria in pizzerias}
+                self._index = PizzeriaIndex(pizzerias)
+                self.version += 1
+            self.loaded_at = time.monotonic()
+
+    def _refresh_in_background(self, token):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refresh(token)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def ensure_loaded(self, token):
+        """Load pizzerias if not loaded yet or schedule reload if outdated
+
+        Args:
+            token: authorization token
+        """
+        if self.loaded_at is None:
+            self.refresh(token)
+        elif time.monotonic() - self.loaded_at > self.refresh_interval:
+            self._refresh_in_background(token)
+
+    def get(self, pizzeria_id):
+        """Get pizzeria by id
+
+        Args:
+            pizzeria_id: id of pizzeria flow entry
+
+        Returns:
+            Pizzeria record or None if not found
+        """
+        return self._by_id.get(pizzeria_id)
+
+    def all(self):
+        return self._pizzerias
+
+    def nearest(self, coordinates, count=1):
+        """Find pizzerias nearest to given coordinates
+
+        Args:
+            coordinates: (latitude, longitude) of the searched place
+            count: number of pizzerias to find
+
+        Returns:
+            list: Pizzeria records ordered from the nearest one
+        """
+        return self._index.nearest(coordinates, count)
+
+
+pizzerias = PizzeriaRegistry()
@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import threading
+
+from api.moltin_requests import fetch_image_by_id
+from helpers.metrics import cache_lookups
+
+PRODUCT_IMAGES_FILE = 'product_images.json'
+
+
+def get_main_image_id(product):
+    """Get id of product main image
+
+    Args:
+        product: product details dictionary
+
+    Returns:
+        id of main image or None if product has no image
+    """
+    main_image = product.get('relationships', {}).get('main_image', {})
+
+    return (main_image.get('data') or {}).get('id')
+
+
+class ProductImages:
+    """Persistent map of product ids to their main image urls.
+
+    Map is filled from `included` block of products responses fetched with
+    `include=main_image`, so images are resolved without extra requests.
+    Each entry remembers image id, so it gets outdated as soon as product
+    main image is changed.
+
+    Args:
+        filename: path to json file storing the map
+    """
+
+    def __init__(self, filename=PRODUCT_IMAGES_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._images = self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as images_file:
+                return json.load(images_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with tempfile.NamedTemporaryFile(
+            'w',
+            dir=directory,
+            delete=False,
+        ) as images_file:
+            json.dump(self._images, images_file)
+        os.replace(images_file.name, self.filename)
+
+    def _set(self, product_id, image_id, image_url):
+        entry = {'image_id': image_id, 'url': image_url}
+        if self._images.get(product_id) == entry:
+            return False
+
+        self._images[product_id] = entry
+        return True
+
+    def update_from_response(self, products_response):
+        """Remember image urls of products included in API response
+
+        Args:
+            products_response: API response of products fetched with
+                `include=main_image`, either list or single product one
+        """
+        products = products_response['data']
+        if isinstance(products, dict):
+            products = [products]
+
+        included_images = {
+            image['id']: image['link']['href']
+            for image in products_response.get('included', {}).get(
+                'main_images', []
+            )
+        }
+
+        with self._lock:
+            changed = False
+            for product in products:
+                image_id = get_main_image_id(product)
+                if image_id in included_images:
+                    changed |= self._set(
+                        product['id'],
+                        image_id,
+                        included_images[image_id],
+                    )
+            if changed:
+                self._save()
+
+    def get_url(self, auth, product):
+        """Get url of product main image
+
+        Image is fetched from API only if it is not known yet, token is
+        requested only then.
+
+        Args:
+            auth: token provider, i.e. AuthToken
+            product: product details dictionary
+
+        Returns:
+            url of product main image or None if product has no image
+        """
+        image_id = get_main_image_id(product)
+        if not image_id:
+            return None
+
+        entry = self._images.get(product['id'])
+        if entry and entry['image_id'] == image_id:
+            cache_lookups.labels(cache='product_images', result='hit').inc()
+            return entry['url']
+
+        cache_lookups.labels(cache='product_images', result='miss').inc()
+        image = fetch_image_by_id(auth.token, image_id)['data']
+        image_url = image['link']['href']
+
+        with self._lock:
+            if self._set(product['id'], image_id, image_url):
+                self._save()
+
+        return image_url
+
+
+product_images = ProductImages()
@@ -0,0 +1,163 @@
+import collections
+import hmac
+import math
+import sys
+import threading
+import time
+
+MAX_PROFILE_SECONDS = 60
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+
+    return f'{code.co_name} ({code.co_filename}:{frame.f_lineno})'
+
+
+class SamplingProfiler:
+    """Profiler sampling stacks of all threads every `interval` seconds.
+
+    Sampling runs in a background thread only between `start` and `stop`,
+    so profiler may be switched on and off in production at runtime.
+    Stacks are dumped in collapsed format accepted by flamegraph tools.
+
+    Args:
+        interval: seconds between samples
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = 0
+
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Start sampling, previously collected stacks are dropped
+
+        Returns:
+            True if sampling is started, False if it's already running
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+
+            self._stacks.clear()
+            self.samples = 0
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='sampling_profiler',
+                daemon=True,
+            )
+            self._thread.start()
+
+        return True
+
+    def stop(self):
+        """Stop sampling and keep collected stacks"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread:
+            self._stopped.set()
+            thread.join()
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_thread_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(get_frame_name(frame))
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def dump(self, limit=50):
+        """Dump the hottest stacks
+
+        Args:
+            limit: maximum number of stacks to dump
+
+        Returns:
+            collapsed stacks with numbers of samples, one per line
+        """
+        with self._lock:
+            hottest_stacks = self._stacks.most_common(limit)
+
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in hottest_stacks
+        )
+
+    def profile(self, seconds, limit=50):
+        """Sample stacks during given time and dump the hottest ones
+
+        Args:
+            seconds: duration of sampling
+            limit: maximum number of stacks to dump
+
+        Returns:
+            collapsed stacks with numbers of samples, one per line, or None
+            if profiler is already running
+        """
+        if not self.start():
+            return None
+
+        try:
+            time.sleep(seconds)
+        finally:
+            self.stop()
+
+        return self.dump(limit)
+
+
+profiler = SamplingProfiler()
+
+
+def handle_profile_request(token, seconds, profiler_token):
+    """Profile process on request of HTTP endpoint
+
+    Endpoint is disabled unless `profiler_token` is set, and request must
+    present the same token.
+
+    Args:
+        token: token presented by request
+        seconds: requested duration of sampling, 10 seconds if not set
+        profiler_token: secret token enabling profiling
+
+    Returns:
+        tuple of HTTP status and response text
+    """
+    if not profiler_token or not hmac.compare_digest(
+        str(token or ''),
+        profiler_token,
+    ):
+        return 404, 'Not found'
+
+    try:
+        seconds = float(seconds or 10)
+    except ValueError:
+        return 400, 'Invalid duration'
+    if not math.isfinite(seconds):
+        return 400, 'Invalid duration'
+
+    stacks = profiler.profile(min(max(seconds, 0), MAX_PROFILE_SECONDS))
+    if stacks is None:
+        return 409, 'Profiler is already running'
+
+    return 200, stacks
@@ -0,0 +1,270 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from collections import defaultdict
+
+from telegram.ext import BasePersistence
+
+SQLITE_PERSISTENCE_FILE = 'conversationbot.sqlite3'
+
+
+class SQLitePersistence(BasePersistence):
+    """Bot persistence stored in SQLite database in WAL mode.
+
+    Every user data, chat data, bot data key and conversation state is
+    stored in its own row, and a row is written only when its content has
+    changed. Database can be shared by several bot processes of the same
+    host: data of each update is reloaded from database before handling.
+
+    Args:
+        filename: path to SQLite database file
+        store_user_data: whether user_data should be saved
+        store_chat_data: whether chat_data should be saved
+        store_bot_data: whether bot_data should be saved
+        transient_bot_data_keys: bot_data keys which are never saved, i.e.
+            ones holding live objects like connections
+    """
+
+    def __init__(
+        self,
+        filename=SQLITE_PERSISTENCE_FILE,
+        store_user_data=True,
+        store_chat_data=True,
+        store_bot_data=True,
+        transient_bot_data_keys=(),
+    ):
+        super().__init__(
+            store_user_data=store_user_data,
+            store_chat_data=store_chat_data,
+            store_bot_data=store_bot_data,
+        )
+        self.filename = filename
+        self.transient_bot_data_keys = set(transient_bot_data_keys)
+
+        self._lock = threading.Lock()
+        self._blobs = {}
+        self._connection = sqlite3.connect(
+            filename,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS data ('
+            'kind TEXT, key TEXT, value BLOB, PRIMARY KEY (kind, key))'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS conversations ('
+            'name TEXT, key TEXT, state BLOB, PRIMARY KEY (name, key))'
+        )
+
+    def _select(self, query, params=()):
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def _load_rows(self, kind, key=None):
+        if key is None:
+            rows = self._select(
+                'SELECT key, value FROM data WHERE kind = ?',
+                (kind,),
+            )
+        else:
+            rows = self._select(
+                'SELECT key, value FROM data WHERE kind = ? AND key = ?',
+                (kind, str(key)),
+            )
+
+        for row_key, blob in rows:
+            self._blobs[(kind, row_key)] = blob
+
+        return rows
+
+    def _write(self, kind, key, value):
+        key = str(key)
+        blob = pickle.dumps(value)
+        if self._blobs.get((kind, key)) == blob:
+            return
+
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO data VALUES (?, ?, ?)',
+                (kind, key, blob),
+            )
+        self._blobs[(kind, key)] = blob
+
+    def _refresh(self, kind, key, data):
+        rows = self._load_rows(kind, key)
+        if rows:
+            data.clear()
+            data.update(self.insert_bot(pickle.loads(rows[0][1])))
+
+    def get_user_data(self):
+        return defaultdict(
+            dict,
+            {
+                int(key): pickle.loads(blob)
+                for key, blob in self._load_rows('user')
+            },
+        )
+
+    def get_chat_data(self):
+        return defaultdict(
+            dict,
+            {
+                int(key): pickle.loads(blob)
+                for key, blob in self._load_rows('chat')
+            },
+        )
+
+    def get_bot_data(self):
+        return {
+            key: pickle.loads(blob)
+            for key, blob in self._load_rows('bot')
+            if key not in self.transient_bot_data_keys
+        }
+
+    def get_conversations(self, name):
+        rows = self._select(
+            'SELECT key, state FROM conversations WHERE name = ?',
+            (name,),
+        )
+
+        return {
+            tuple(json.loads(key)): pickle.loads(state) for key, state in rows
+        }
+
+    def get_conversation(self, name, key):
+        """Get state of a single conversation
+
+        Args:
+            name: name of conversation handler
+            key: conversation key
+
+        Returns:
+            conversation state or None if conversation is not active
+        """
+        rows = self._select(
+            'SELECT state FROM conversations WHERE name = ? AND key = ?',
+            (name, json.dumps(key)),
+        )
+
+        return pickle.loads(rows[0][0]) if rows else None
+
+    def update_conversation(self, name, key, new_state):
+        with self._lock:
+            if new_state is None:
+                self._connection.execute(
+                    'DELETE FROM conversations WHERE name = ? AND key = ?',
+                    (name, json.dumps(key)),
+                )
+            else:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)',
+                    (name, json.dumps(key), pickle.dumps(new_state)),
+                )
+
+    def update_user_data(self, user_id, data):
+        self._write('user', user_id, data)
+
+    def update_chat_data(self, chat_id, data):
+        self._write('chat', chat_id, data)
+
+    def update_bot_data(self, data):
+        data = {
+            key: value
+            for key, value in data.items()
+            if key not in self.transient_bot_data_keys
+        }
+        for key, value in data.items():
+            self._write('bot', key, value)
+
+        removed_keys = [
+            key
+            for kind, key in list(self._blobs)
+            if kind == 'bot' and key not in data
+        ]
+        with self._lock:
+            for key in removed_keys:
+                self._connection.execute(
+                    'DELETE FROM data WHERE kind = ? AND key = ?',
+                    ('bot', key),
+                )
+                del self._blobs[('bot', key)]
+
+    def refresh_user_data(self, user_id, user_data):
+        self._refresh('user', user_id, user_data)
+
+    def refresh_chat_data(self, chat_id, chat_data):
+        self._refresh('chat', chat_id, chat_data)
+
+    def refresh_bot_data(self, bot_data):
+        known_blobs = dict(self._blobs)
+        for key, blob in self._load_rows('bot'):
+            if key in self.transient_bot_data_keys:
+                continue
+            if known_blobs.get(('bot', key)) != blob:
+                bot_data[key] = self.insert_bot(pickle.loads(blob))
+
+    def flush(self):
+        with self._lock:
+            self._connection.close()
+
+    def is_empty(self):
+        """Check whether database has no data saved yet
+
+        Returns:
+            True if database is empty
+        """
+        return not (
+            self._select('SELECT 1 FROM data LIMIT 1')
+            or self._select('SELECT 1 FROM conversations LIMIT 1')
+        )
+
+    def migrate_pickle(self, pickle_filename):
+        """Copy data saved by single file PicklePersistence to database
+
+        Args:
+            pickle_filename: path to PicklePersistence file
+        """
+        with open(pickle_filename, 'rb') as pickle_file:
+            data = pickle.load(pickle_file)
+
+        for user_id, user_data in data.get('user_data', {}).items():
+            self._write('user', user_id, user_data)
+        for chat_id, chat_data in data.get('chat_data', {}).items():
+            self._write('chat', chat_id, chat_data)
+        for key, value in data.get('bot_data', {}).items():
+            if key not in self.transient_bot_data_keys:
+                self._write('bot', key, value)
+        for name, conversations in data.get('conversations', {}).items():
+            for key, state in conversations.items():
+                self.update_conversation(name, key, state)
+
+
+def create_persistence(filename, pickle_filename=None, **persistence_params):
+    """Create SQLite persistence migrating pickle file if it exists
+
+    Pickle file is migrated only into empty database.
+
+    Args:
+        filename: path to SQLite database file
+        pickle_filename: path to file of previously used PicklePersistence
+        persistence_params: other SQLitePersistence parameters
+
+    Returns:
+        SQLitePersistence instance
+    """
+    persistence = SQLitePersistence(filename, **persistence_params)
+
+    if (
+        pickle_filename
+        and os.path.exists(pickle_filename)
+        and persistence.is_empty()
+    ):
+        persistence.migrate_pickle(pickle_filename)
+
+    return persistence
@@ -1,22 +1,165 @@
 import textwrap
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    ParseMode,
+)
+from telegram.error import BadRequest
 
-from api.moltin_requests import fetch_image_by_id, fetch_cart_items
 from helpers.tg_items_formatters import (
     format_cart_item,
     format_delivery_options,
     format_order,
 )
+from helpers.carts import carts
 from helpers.delivery import calculate_delivery_cost
+from helpers.product_images import get_main_image_id, product_images
+from helpers.tg_send_queue import PRIORITY_COURIER, get_send_queue
+from helpers.view_cache import views
 
 
-def send_products(products, chat):
-    """Send products list with keyboard to the chat.
+def is_bot_message(message):
+    return bool(message.from_user and message.from_user.is_bot)
+
+
+def is_not_modified(error):
+    return 'message is not modified' in error.message.lower()
+
+
+def replace_message(message, send_function, *args, **kwargs):
+    """Delete bot message and send a new one instead
+
+    Args:
+        message: bot message to replace
+        send_function: bot method sending new message
+        args: positional arguments of send function
+        kwargs: keyword arguments of send function
+
+    Returns:
+        sent message
+    """
+    send_queue = get_send_queue()
+    try:
+        send_queue.send(message.chat_id, message.delete)
+    except BadRequest:
+        # message is already deleted or too old to be deleted by bot
+        pass
+
+    return send_queue.send(message.chat_id, send_function, *args, **kwargs)
+
+
+def render_text(message, text, reply_markup=None, parse_mode=None):
+    """Show text in place of bot message.
+
+    Bot text message is edited in place, bot photo message is replaced
+    with a new one since telegram cannot turn photo into text. Text is
+    sent as a new message in reply to client message.
+
+    Args:
+        message: message to show text in place of
+        text: text to show
+        reply_markup: keyboard attached to text
+        parse_mode: parse mode of text
+
+    Returns:
+        message showing the text
+    """
+    send_queue = get_send_queue()
+
+    if not is_bot_message(message):
+        return send_queue.send(
+            message.chat_id,
+            message.reply_text,
+            text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode,
+        )
+
+    if not message.photo:
+        try:
+            return send_queue.send(
+                message.chat_id,
+                message.edit_text,
+                text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode,
+            )
+        except BadRequest as error:
+            if is_not_modified(error):
+                return message
+
+    return replace_message(
+        message,
+        message.bot.send_message,
+        message.chat_id,
+        text,
+        reply_markup=reply_markup,
+        parse_mode=parse_mode,
+    )
+
+
+def render_photo(message, photo, caption, reply_markup=None, parse_mode=None):
+    """Show photo in place of bot message.
+
+    Bot photo message gets new photo and caption in place, bot text message
+    is replaced with a new one since telegram cannot turn text into photo.
+    Photo is sent as a new message in reply to client message.
+
+    Args:
+        message: message to show photo in place of
+        photo: photo url or telegram file_id
+        caption: photo caption
+        reply_markup: keyboard attached to photo
+        parse_mode: parse mode of caption
+
+    Returns:
+        message showing the photo
+    """
+    if is_bot_message(message) and message.photo:
+        try:
+            return get_send_queue().send(
+                message.chat_id,
+                message.edit_media,
+                InputMediaPhoto(photo, caption=caption, parse_mode=parse_mode),
+                reply_markup=reply_markup,
+            )
+        except BadRequest as error:
+            if is_not_modified(error):
+                return message
+
+    send_params = {
+        'caption': caption,
+        'reply_markup': reply_markup,
+        'parse_mode': parse_mode,
+    }
+    if is_bot_message(message):
+        return replace_message(
+            message,
+            message.bot.send_photo,
+            message.chat_id,
+            photo,
+            **send_params,
+        )
+
+    return get_send_queue().send(
+        message.chat_id,
+        message.bot.send_photo,
+        message.chat_id,
+        photo,
+        **send_params,
+    )
+
+
+def render_products_keyboard(products):
+    """Render keyboard of products menu
 
     Args:
         products: products dictionary
-        chat: telegram chat instance to send products to
+
+    Returns:
+        keyboard markup
     """
     keyboard = [
         [InlineKeyboardButton(product['name'], callback_data=product['id'])]
@@ -24,21 +167,18 @@ def send_products(products, chat):
     ]
     keyboard.append([InlineKeyboardButton('Корзина', callback_data='Cart')])
 
-    chat.reply_text('Каталог', reply_markup=InlineKeyboardMarkup(keyboard))
+    return InlineKeyboardMarkup(keyboard)
 
 
-def send_product_details(product, chat, auth_token):
-    """Send product details with keyboard to the chat.
+def render_product_details(product):
+    """Render caption and keyboard of product details
 
     Args:
         product: product details dictionary
-        chat: telegram chat instance to send product details to
-        auth_token: bearer token to request a product image
-    """
-    product_image_id = product['relationships']['main_image']['data']['id']
-    product_image = fetch_image_by_id(auth_token, product_image_id)['data']
-    product_image_url = product_image['link']['href']
 
+    Returns:
+        tuple of caption and keyboard markup
+    """
     product_id = product['id']
     product_price = product['meta']['display_price']['without_tax']['amount']
 
@@ -68,21 +208,88 @@ def send_product_details(product, chat, auth_token):
         ],
     ]
 
-    chat.bot.send_photo(
-        chat.chat_id,
-        product_image_url,
-        caption=caption,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+    return caption, InlineKeyboardMarkup(keyboard)
+
+
+def send_products(products, chat):
+    """Show products list with keyboard in the chat.
+
+    Keyboard is rendered once per catalog version, see `ViewCache`.
+
+    Args:
+        products: products dictionary
+        chat: telegram message to show products in place of
+    """
+    reply_markup = views.get(
+        'tg_products',
+        products,
+        lambda: render_products_keyboard(products),
+    )
+
+    render_text(chat, 'Каталог', reply_markup=reply_markup)
+
+
+def send_product_details(
+    product, chat, auth, photo_file_ids, image_url=None
+):
+    """Show product details with keyboard in the chat.
+
+    Product photo is sent by url only once, later on it is sent by telegram
+    file_id remembered in `photo_file_ids` until product image is changed.
+    Caption and keyboard are rendered once per catalog version.
+
+    Args:
+        product: product details dictionary
+        chat: telegram message to show product details in place of
+        auth: token provider to request a product image if unknown
+        photo_file_ids: persistent mapping of product ids to sent photos
+        image_url: url of product main image if already resolved, see
+            `fetch_product_with_image_url`
+    """
+
+    product_id = product['id']
+    caption, reply_markup = views.get(
+        f'tg_product_{product_id}',
+        product,
+        lambda: render_product_details(product),
+    )
+
+    image_id = get_main_image_id(product)
+    sent_photo = photo_file_ids.get(product_id)
+
+    if sent_photo and sent_photo['image_id'] == image_id:
+        try:
+            return render_photo(
+                chat,
+                sent_photo['file_id'],
+                caption,
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.HTML,
+            )
+        except BadRequest:
+            photo_file_ids.pop(product_id, None)
+
+    message = render_photo(
+        chat,
+        image_url or product_images.get_url(auth, product),
+        caption,
+        reply_markup=reply_markup,
         parse_mode=ParseMode.HTML,
     )
+    photo_file_ids[product_id] = {
+        'image_id': image_id,
+        'file_id': message.photo[-1].file_id,
+    }
+
+    return message
 
 
 def send_cart(cart, chat):
-    """Send cart items list with keyboard to chat
+    """Show cart items list with keyboard in the chat
 
     Args:
         cart: cart items dictionary
-        chat: telegram chat instance to send cart items to
+        chat: telegram message to show cart items in place of
     """
     bot_reply = ''.join(
         format_cart_item(cart_item) for cart_item in cart['data']
@@ -115,7 +322,8 @@ def send_cart(cart, chat):
         [InlineKeyboardButton('Обратно в меню', callback_data='Back to menu')]
     )
 
-    chat.reply_text(
+    render_text(
+        chat,
         bot_reply,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode=ParseMode.HTML,
@@ -128,6 +336,9 @@ def send_delivery_options(nearest_pizzeria, chat):
     Args:
         nearest_pizzeria: the closest pizzeria to client
         chat: chat to send delivery options to
+
+    Returns:
+        sent message
     """
     distance = nearest_pizzeria['distance']
     delivery_cost = calculate_delivery_cost(distance)
@@ -138,19 +349,18 @@ def send_delivery_options(nearest_pizzeria, chat):
         delivery_cost=delivery_cost,
     )
     keyboard = [[InlineKeyboardButton('Самовывоз', callback_data='pickup')]]
-
-    if distance > 20:
-        return chat.reply_text(
-            bot_reply,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+    if distance <= 20:
+        keyboard.append(
+            [InlineKeyboardButton('Доставка', callback_data='delivery')]
         )
 
-    keyboard.append(
-        [InlineKeyboardButton('Доставка', callback_data='delivery')]
+    return get_send_queue().send(
+        chat.chat_id,
+        chat.reply_text,
+        bot_reply,
+        reply_markup=InlineKeyboardMarkup(keyboard),
     )
 
-    chat.reply_text(bot_reply, reply_markup=InlineKeyboardMarkup(keyboard))
-
 
 def send_order_details(
     cart_id, auth_token, pizzeria, client_coordinates, delivery_cost, chat
@@ -165,7 +375,7 @@ def send_order_details(
         delivery_cost: cost of delivery in rubles
         chat: chat to send order details to
     """
-    cart = fetch_cart_items(auth_token, f'pizza_{cart_id}')
+    cart = carts.get(auth_token, f'pizza_{cart_id}')
     cart_formatted = format_order(cart, delivery_cost)
 
     deliveryman_tg_id = pizzeria['deliveryman_telegram_id']
@@ -174,9 +384,19 @@ def send_order_details(
         f'<strong>Заказ от клиента {cart_id}</strong>\n\n{cart_formatted}'
     )
 
-    chat.send_message(
+    send_queue = get_send_queue()
+    send_queue.send(
+        deliveryman_tg_id,
+        chat.send_message,
         deliveryman_tg_id,
         text=bot_reply,
         parse_mode=ParseMode.HTML,
+        priority=PRIORITY_COURIER,
+    )
+    send_queue.send(
+        deliveryman_tg_id,
+        chat.send_location,
+        deliveryman_tg_id,
+        priority=PRIORITY_COURIER,
+        **client_coordinates,
     )
-    chat.send_location(deliveryman_tg_id, **client_coordinates)
@@ -0,0 +1,244 @@
+import fcntl
+import logging
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+from telegram.ext import ConversationHandler, Dispatcher
+
+USER_LOCKS_DIR = 'conversationbot.locks'
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedExecutor:
+    """Bounded thread pool running tasks of the same key one after another.
+
+    Tasks of different keys run concurrently on at most `max_workers`
+    threads. Submitting blocks as soon as `max_pending` tasks are waiting.
+
+    Args:
+        max_workers: maximum number of worker threads
+        max_pending: maximum number of submitted but not finished tasks
+    """
+
+    def __init__(self, max_workers=8, max_pending=1000):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='keyed_executor',
+        )
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        """Schedule task after all previously submitted tasks of the key
+
+        Args:
+            key: ordering key, i.e. chat id
+            function: task callable
+            args: task callable arguments
+
+        Returns:
+            future of task result
+        """
+        self._pending.acquire()
+
+        future = Future()
+        with self._lock:
+            if key in self._queues:
+                self._queues[key].append((function, args, future))
+                return future
+            self._queues[key] = deque([(function, args, future)])
+
+        self._executor.submit(self._drain, key)
+
+        return future
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                function, args, future = queue.popleft()
+
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                logger.exception('Task of key %s failed', key)
+                future.set_exception(error)
+            finally:
+                self._pending.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def get_ordering_key(update):
+    """Get key of updates which have to be processed in order
+
+    Conversation states are kept per user, so updates of the same user are
+    ordered, falling back to chat for updates without user.
+
+    Args:
+        update: incoming telegram update
+
+    Returns:
+        user or chat id, None if update belongs to neither of them
+    """
+    if user := getattr(update, 'effective_user', None):
+        return user.id
+    if chat := getattr(update, 'effective_chat', None):
+        return chat.id
+
+    return None
+
+
+class FileKeyLocks:
+    """Locks of ordering keys shared by all processes of the host.
+
+    Keys are spread over `stripes` lock files in `directory`, key is locked
+    by exclusive flock of its file. Lock of a crashed process is released
+    by OS. Keys sharing a file wait for each other, which is rare enough.
+
+    Args:
+        directory: directory of lock files
+        stripes: number of lock files
+    """
+
+    def __init__(self, directory=USER_LOCKS_DIR, stripes=256):
+        self.directory = directory
+        self.stripes = stripes
+
+        os.makedirs(directory, exist_ok=True)
+
+    def get_filename(self, key):
+        stripe = zlib.crc32(str(key).encode()) % self.stripes
+
+        return os.path.join(self.directory, f'{stripe}.lock')
+
+    @contextmanager
+    def lock(self, key):
+        """Hold lock of the key
+
+        Args:
+            key: ordering key, i.e. user id
+        """
+        with open(self.get_filename(key), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ConcurrentDispatcher(Dispatcher):
+    """Dispatcher processing updates concurrently on a bounded pool.
+
+    Updates of the same user are processed one after another, so handlers
+    never race on the same cart or conversation state. If `key_locks` are
+    set, i.e. FileKeyLocks, update is processed holding lock of the user,
+    so updates of the user received by several processes don't overlap
+    either. `prepare_update` callable, if set, is called with update right
+    before its processing, in order with other updates of the user.
+
+    Args:
+        executor: KeyedExecutor running updates processing
+        args and kwargs: standard Dispatcher arguments
+    """
+
+    def __init__(self, *args, executor, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = executor
+        self.prepare_update = None
+        self.key_locks = None
+
+    def _process_prepared_update(self, update, key=None):
+        if self.key_locks and key is not None:
+            lock = self.key_locks.lock(key)
+        else:
+            lock = nullcontext()
+
+        with lock:
+            if self.prepare_update:
+                self.prepare_update(update)
+
+            super().process_update(update)
+
+    def process_update(self, update):
+        """Schedule processing of update after previous updates of the user
+
+        Args:
+            update: incoming telegram update
+
+        Returns:
+            future of update processing or None if update is processed
+            right away, as it belongs to no user
+        """
+        key = get_ordering_key(update)
+        if key is None:
+            self._process_prepared_update(update)
+            return None
+
+        return self.executor.submit(
+            key, self._process_prepared_update, update, key
+        )
+
+    def stop(self):
+        super().stop()
+        self.executor.shutdown()
+
+
+class SyncedConversationHandler(ConversationHandler):
+    """Conversation handler able to reload a single conversation state.
+
+    ConversationHandler keeps states in memory and reads persistence only
+    when it's added to dispatcher, so state changed by another process has
+    to be reloaded before update is handled, see `reload_conversation`.
+
+    Private members of python-telegram-bot 13.8 ConversationHandler are
+    used, so they are checked on creation, see requirements.txt for the
+    pinned version.
+
+    Args:
+        args and kwargs: standard ConversationHandler arguments
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if not (
+            hasattr(self, '_conversations_lock') and hasattr(self, '_get_key')
+        ):
+            raise RuntimeError(
+                'Unsupported python-telegram-bot version, see requirements.txt'
+            )
+
+    def reload_conversation(self, update):
+        """Load state of update conversation saved by other processes
+
+        Only persistence able to read single conversation state is
+        supported, i.e. SQLitePersistence.
+
+        Args:
+            update: incoming telegram update
+        """
+        persistence = self.persistence
+        if not hasattr(persistence, 'get_conversation'):
+            return
+        if not update.effective_user:
+            return
+
+        key = self._get_key(update)
+        state = persistence.get_conversation(self.name, key)
+
+        with self._conversations_lock:
+            if state is None:
+                self.conversations.pop(key, None)
+            else:
+                self.conversations[key] = state
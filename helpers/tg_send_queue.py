@@ -0,0 +1,373 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_COURIER = 0
+PRIORITY_REPLY = 1
+PRIORITY_MARKETING = 2
+
+LANE_NAMES = {
+    PRIORITY_COURIER: 'courier',
+    PRIORITY_REPLY: 'reply',
+    PRIORITY_MARKETING: 'marketing',
+}
+
+send_queue_depth = Gauge(
+    'pizza_bot_tg_send_queue_depth',
+    'Number of telegram calls waiting in send queue by lane.',
+    ['lane'],
+    multiprocess_mode='livesum',
+)
+sent_calls = Counter(
+    'pizza_bot_tg_send_queue_calls_total',
+    'Telegram calls made by send queue by result.',
+    ['result'],
+)
+
+
+class TokenBucket:
+    """Token bucket refilled with `rate` tokens per second.
+
+    Args:
+        rate: tokens added per second
+        capacity: maximum number of tokens, i.e. allowed burst
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _fill(self, now):
+        elapsed = max(now - self.updated_at, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def get_wait_time(self, now):
+        self._fill(now)
+        if self.tokens >= 1:
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._fill(now)
+        self.tokens -= 1
+
+    def postpone(self, delay, now):
+        self._fill(now)
+        self.tokens = min(self.tokens, 1 - delay * self.rate)
+
+    def is_full(self, now):
+        self._fill(now)
+        return self.tokens >= self.capacity
+
+
+class OutgoingMessage:
+    def __init__(self, chat_id, send_function, args, kwargs, priority):
+        self.chat_id = chat_id
+        self.send_function = send_function
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.retries = 0
+        self.future = Future()
+
+
+class SendQueue:
+    """Outbound queue of Bot API calls respecting telegram flood limits.
+
+    Calls are sent no faster than `global_rate` per second in total and
+    `chat_rate` per second to every chat, with bursts of up to
+    `chat_burst` messages. Lanes are drained by priority: courier
+    notifications first, then replies to clients, then marketing messages.
+    Calls to the same chat are sent one by one in submission order.
+
+    Call rejected with RetryAfter is put back to the head of its lane and
+    its chat is paused for requested time, at most `max_retries` times.
+
+    Args:
+        global_rate: maximum number of calls per second to all chats
+        chat_rate: maximum number of calls per second to a single chat
+        chat_burst: maximum number of calls sent to a chat at once
+        senders: number of threads making calls
+        max_retries: maximum number of retries of a call
+        max_chat_buckets: number of chats after which idle ones are dropped
+    """
+
+    def __init__(
+        self,
+        global_rate=30,
+        chat_rate=1,
+        chat_burst=3,
+        senders=4,
+        max_retries=3,
+        max_chat_buckets=10000,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.senders = senders
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+        self._lanes = {priority: deque() for priority in sorted(LANE_NAMES)}
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._executor = None
+        self._scheduler = None
+        self._stopped = False
+
+    def _start(self):
+        if self._scheduler is not None:
+            return
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.senders,
+            thread_name_prefix='tg_sender',
+        )
+        self._scheduler = threading.Thread(
+            target=self._run,
+            name='tg_send_queue',
+            daemon=True,
+        )
+        self._scheduler.start()
+
+    def submit(
+        self, chat_id, send_function, *args, priority=PRIORITY_REPLY, **kwargs
+    ):
+        """Put Bot API call to the queue
+
+        Args:
+            chat_id: id of chat the call sends to
+            send_function: Bot API method, i.e. bot.send_message
+            args: positional arguments of method
+            priority: lane of call, i.e. PRIORITY_COURIER
+            kwargs: keyword arguments of method
+
+        Returns:
+            future resolved with result of the call
+        """
+        message = OutgoingMessage(
+            chat_id,
+            send_function,
+            args,
+            kwargs,
+            priority,
+        )
+
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('Send queue is stopped')
+            self._start()
+            self._lanes[priority].append(message)
+            send_queue_depth.labels(lane=LANE_NAMES[priority]).inc()
+            self._condition.notify()
+
+        return message.future
+
+    def send(
+        self, chat_id, send_function, *args, priority=PRIORITY_REPLY, **kwargs
+    ):
+        """Put Bot API call to the queue and wait for its result
+
+        Args:
+            chat_id: id of chat the call sends to
+            send_function: Bot API method, i.e. bot.send_message
+            args: positional arguments of method
+            priority: lane of call, i.e. PRIORITY_COURIER
+            kwargs: keyword arguments of method
+
+        Returns:
+            result of the call, i.e. sent message
+        """
+        future = self.submit(
+            chat_id,
+            send_function,
+            *args,
+            priority=priority,
+            **kwargs,
+        )
+
+        return future.result()
+
+    def _get_chat_bucket(self, chat_id, now):
+        if chat_id not in self._chat_buckets:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                self._chat_buckets = {
+                    known_chat_id: bucket
+                    for known_chat_id, bucket in self._chat_buckets.items()
+                    if not bucket.is_full(now)
+                }
+            self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate,
+                self.chat_burst,
+            )
+
+        return self._chat_buckets[chat_id]
+
+    def _pick(self, now):
+        if global_wait_time := self._global_bucket.get_wait_time(now):
+            return None, global_wait_time
+
+        wait_time = None
+        blocked_chats = set(self._in_flight)
+        for lane in self._lanes.values():
+            for message in lane:
+                if message.chat_id in blocked_chats:
+                    continue
+                blocked_chats.add(message.chat_id)
+
+                chat_bucket = self._get_chat_bucket(message.chat_id, now)
+                if chat_wait_time := chat_bucket.get_wait_time(now):
+                    if wait_time is None or chat_wait_time < wait_time:
+                        wait_time = chat_wait_time
+                    continue
+
+                lane.remove(message)
+                send_queue_depth.labels(
+                    lane=LANE_NAMES[message.priority]
+                ).dec()
+                chat_bucket.consume(now)
+                self._global_bucket.consume(now)
+
+                return message, None
+
+        return None, wait_time
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                message, wait_time = self._pick(time.monotonic())
+                if message is None:
+                    self._condition.wait(wait_time)
+                    continue
+
+                self._in_flight.add(message.chat_id)
+                self._executor.submit(self._deliver, message)
+
+    def _deliver(self, message):
+        try:
+            result = message.send_function(*message.args, **message.kwargs)
+        except RetryAfter as error:
+            with self._condition:
+                self._in_flight.discard(message.chat_id)
+                self._condition.notify()
+
+                if message.retries < self.max_retries:
+                    message.retries += 1
+                    self.retried += 1
+                    sent_calls.labels(result='retried').inc()
+                    now = time.monotonic()
+                    chat_bucket = self._get_chat_bucket(message.chat_id, now)
+                    chat_bucket.postpone(error.retry_after, now)
+                    self._lanes[message.priority].appendleft(message)
+                    send_queue_depth.labels(
+                        lane=LANE_NAMES[message.priority]
+                    ).inc()
+                    return
+
+                self.failed += 1
+                sent_calls.labels(result='failed').inc()
+
+            logger.warning('Call to chat %s is rate limited', message.chat_id)
+            message.future.set_exception(error)
+        except Exception as error:
+            with self._condition:
+                self._in_flight.discard(message.chat_id)
+                self.failed += 1
+                sent_calls.labels(result='failed').inc()
+                self._condition.notify()
+
+            logger.exception('Call to chat %s failed', message.chat_id)
+            message.future.set_exception(error)
+        else:
+            with self._condition:
+                self._in_flight.discard(message.chat_id)
+                self.sent += 1
+                sent_calls.labels(result='sent').inc()
+                self._condition.notify()
+
+            message.future.set_result(result)
+
+    def get_metrics(self):
+        """Get queue depth and counters of calls
+
+        Returns:
+            dictionary with number of queued calls by lane, calls in
+            flight, sent, retried and failed calls
+        """
+        with self._condition:
+            return {
+                'queued': {
+                    LANE_NAMES[priority]: len(lane)
+                    for priority, lane in self._lanes.items()
+                },
+                'in_flight': len(self._in_flight),
+                'sent': self.sent,
+                'retried': self.retried,
+                'failed': self.failed,
+            }
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            pending_messages = [
+                message for lane in self._lanes.values() for message in lane
+            ]
+            for priority, lane in self._lanes.items():
+                send_queue_depth.labels(lane=LANE_NAMES[priority]).dec(
+                    len(lane)
+                )
+                lane.clear()
+            self._condition.notify_all()
+
+        for message in pending_messages:
+            message.future.set_exception(
+                RuntimeError('Send queue is stopped')
+            )
+
+        if self._executor:
+            self._executor.shutdown()
+
+
+_send_queue = SendQueue()
+
+
+def get_send_queue():
+    """Get send queue shared inside the process
+
+    Returns:
+        shared SendQueue instance
+    """
+    return _send_queue
+
+
+def configure_send_queue(**queue_params):
+    """Replace shared send queue with a newly configured one
+
+    Args:
+        queue_params: SendQueue parameters
+
+    Returns:
+        shared SendQueue instance
+    """
+    global _send_queue
+
+    _send_queue.stop()
+    _send_queue = SendQueue(**queue_params)
+
+    return _send_queue
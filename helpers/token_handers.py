@@ -1,25 +1,194 @@
+import logging
+import threading
 import time
 
+from redis.exceptions import RedisError
+
 from api.moltin_requests import fetch_auth_token
 
+logger = logging.getLogger(__name__)
+
+SHARED_TOKEN_KEY = 'MOLTIN_AUTH_TOKEN'
+SHARED_TOKEN_LOCK_KEY = 'MOLTIN_AUTH_TOKEN_LOCK'
+
 
 class AuthToken:
-    def __init__(self, client_id, client_secret):
+    """Moltin client credentials token refreshed on demand.
+
+    Only one refresh runs at a time, other threads wait for its result.
+    After each refresh token renewal is scheduled `renew_margin` seconds
+    before expiry, so requests don't wait for token fetching.
+
+    Args:
+        client_id: elasticpath client id
+        client_secret: elasticpath client secret
+        renew_margin: seconds before expiry to renew token at
+    """
+
+    def __init__(self, client_id, client_secret, renew_margin=60):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.renew_margin = renew_margin
         self.token_expires = time.time()
         self.auth_token = ''
 
+        self._lock = threading.Lock()
+        self._renewal = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_renewal'] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def is_valid(self):
+        return self.token_expires - time.time() > 10
+
     @property
     def token(self):
-        if self.token_expires - time.time() > 10:
+        if self.is_valid():
             return self.auth_token
 
-        self.__refresh_token()
+        with self._lock:
+            if not self.is_valid():
+                self.__refresh_token()
+
+        return self.auth_token
+
+    def force_refresh(self, stale_token=None):
+        """Refresh token rejected by API
+
+        Args:
+            stale_token: rejected token, token is not refreshed if it has
+                been already replaced by another thread
+
+        Returns:
+            actual token
+        """
+        with self._lock:
+            if stale_token is None or stale_token == self.auth_token:
+                self.__refresh_token(stale_token=self.auth_token)
 
         return self.auth_token
 
-    def __refresh_token(self):
-        token_details = fetch_auth_token(self.client_id, self.client_secret)
+    def _fetch_token_details(self, stale_token=None):
+        """Fetch new token details
+
+        Args:
+            stale_token: token which must not be returned again, if any
+
+        Returns:
+            dictionary with access_token and expires timestamp
+        """
+        return fetch_auth_token(self.client_id, self.client_secret)
+
+    def __refresh_token(self, stale_token=None):
+        token_details = self._fetch_token_details(stale_token)
         self.token_expires = token_details['expires']
         self.auth_token = token_details['access_token']
+
+        lifetime = self.token_expires - time.time()
+        self.__schedule_renewal(
+            max(lifetime - self.renew_margin, lifetime / 2)
+        )
+
+    def __schedule_renewal(self, delay):
+        if self._renewal:
+            self._renewal.cancel()
+
+        self._renewal = threading.Timer(max(delay, 0), self.__renew)
+        self._renewal.daemon = True
+        self._renewal.start()
+
+    def __renew(self):
+        try:
+            with self._lock:
+                self.__refresh_token(stale_token=self.auth_token)
+        except Exception:
+            logger.exception('Failed to renew auth token')
+            self.__schedule_renewal(10)
+
+
+class RedisAuthToken(AuthToken):
+    """Moltin token shared by all processes through redis.
+
+    Token and its expiry are stored in redis. Process needing a new token
+    takes it from redis, and only if stored token is outdated or rejected,
+    fetches new one under distributed lock, so other processes wait and
+    reuse it. If redis is unreachable token is fetched locally.
+
+    Args:
+        client_id: elasticpath client id
+        client_secret: elasticpath client secret
+        db: redis connection
+        renew_margin: seconds before expiry to renew token at
+    """
+
+    def __init__(self, client_id, client_secret, db, renew_margin=60):
+        super().__init__(client_id, client_secret, renew_margin)
+        self.db = db
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['db']
+
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.db = None
+
+    def _load_shared_token(self, stale_token):
+        stored = self.db.hgetall(SHARED_TOKEN_KEY)
+        if not stored:
+            return None
+
+        token_details = {
+            'access_token': stored[b'access_token'].decode(),
+            'expires': float(stored[b'expires']),
+        }
+        if token_details['access_token'] == stale_token:
+            return None
+        if token_details['expires'] - time.time() <= self.renew_margin:
+            return None
+
+        return token_details
+
+    def _fetch_token_details(self, stale_token=None):
+        if self.db is None:
+            return super()._fetch_token_details(stale_token)
+
+        try:
+            if token_details := self._load_shared_token(stale_token):
+                return token_details
+
+            with self.db.lock(
+                SHARED_TOKEN_LOCK_KEY,
+                timeout=10,
+                blocking_timeout=10,
+            ):
+                if token_details := self._load_shared_token(stale_token):
+                    return token_details
+
+                token_details = super()._fetch_token_details(stale_token)
+                self.db.hset(
+                    SHARED_TOKEN_KEY,
+                    mapping={
+                        'access_token': token_details['access_token'],
+                        'expires': token_details['expires'],
+                    },
+                )
+                self.db.expireat(
+                    SHARED_TOKEN_KEY,
+                    int(token_details['expires']),
+                )
+
+                return token_details
+        except RedisError:
+            logger.exception('Shared token is unavailable, fetching locally')
+            return super()._fetch_token_details(stale_token)
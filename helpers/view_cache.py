@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+from helpers.catalog_cache import catalog
+from helpers.metrics import cache_lookups
+
+
+class ViewCache:
+    """In-process cache of views rendered from catalog data.
+
+    Every view remembers data it was rendered from and is rendered again
+    as soon as other data is passed, i.e. after catalog entry is refreshed.
+    All views are dropped when version of catalog cache changes, so views
+    of changed catalog are never served. Cache holds at most `maxsize`
+    views evicting least recently used ones.
+
+    Args:
+        catalog_cache: CatalogCache whose version views are keyed on
+        maxsize: maximum number of cached views
+    """
+
+    def __init__(self, catalog_cache=catalog, maxsize=1024):
+        self.catalog_cache = catalog_cache
+        self.maxsize = maxsize
+
+        self._views = OrderedDict()
+        self._version = catalog_cache.version
+        self._lock = threading.Lock()
+
+    def get(self, key, source, render):
+        """Get cached view or render it
+
+        Args:
+            key: view key, i.e. tg_product_<product id>
+            source: data view is rendered from
+            render: callable without arguments rendering view of source
+
+        Returns:
+            cached or freshly rendered view
+        """
+        version = self.catalog_cache.version
+
+        with self._lock:
+            if version != self._version:
+                self._views.clear()
+                self._version = version
+
+            entry = self._views.get(key)
+            if entry:
+                self._views.move_to_end(key)
+
+        if entry:
+            cached_source, view = entry
+            if cached_source is source or cached_source == source:
+                cache_lookups.labels(cache='views', result='hit').inc()
+                return view
+
+        cache_lookups.labels(cache='views', result='miss').inc()
+        view = render()
+
+        with self._lock:
+            if version == self._version:
+                self._views[key] = (source, view)
+                self._views.move_to_end(key)
+                while len(self._views) > self.maxsize:
+                    self._views.popitem(last=False)
+
+        return view
+
+    def invalidate(self):
+        """Drop all cached views"""
+        with self._lock:
+            self._views.clear()
+
+
+views = ViewCache()
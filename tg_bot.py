@@ -1,31 +1,36 @@
 import os
+from queue import Queue
 from textwrap import dedent
 
 from dotenv import load_dotenv
+from redis import Redis
 from telegram import LabeledPrice
 from telegram.ext import (
     CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
+    ExtBot,
     Filters,
+    JobQueue,
     MessageHandler,
-    PicklePersistence,
     PreCheckoutQueryHandler,
     Updater,
 )
+from telegram.utils.request import Request
 
+from api.moltin_async_requests import (
+    configure_client as configure_async_client,
+    run_coroutine,
+)
 from api.moltin_requests import (
-    add_product_to_cart,
+    API_ROOT,
+    configure_client,
     create_customer,
-    fetch_cart_items,
-    fetch_products,
-    fetch_product_by_id,
-    remove_cart_item_by_id,
     upload_entry,
     EntityExistsError,
 )
-from api.yandex_api_requests import fetch_coordinates
 from helpers.tg_chat_replying import (
+    render_text,
     send_cart,
     send_delivery_options,
     send_order_details,
@@ -34,11 +39,30 @@ from helpers.tg_chat_replying import (
 )
 from helpers.delivery import (
     calculate_delivery_cost,
-    find_nearest_pizzeria,
     get_order_details_for_invoice,
     notify_about_pizza,
+    prepare_checkout,
+)
+from helpers.carts import carts
+from helpers.catalog_cache import catalog, fetch_product_with_image_url
+from helpers.catalog_snapshot import (
+    CATALOG_SNAPSHOT_FILE,
+    load_and_seed_catalog,
+    save_catalog_snapshot,
+)
+from helpers.geocode_cache import fetch_coordinates_cached
+from helpers.metrics import instrument_conversation, start_metrics_server
+from helpers.sqlite_persistence import (
+    SQLITE_PERSISTENCE_FILE,
+    create_persistence,
 )
-from helpers.token_handers import AuthToken
+from helpers.tg_dispatcher import (
+    ConcurrentDispatcher,
+    KeyedExecutor,
+    SyncedConversationHandler,
+)
+from helpers.tg_send_queue import configure_send_queue
+from helpers.token_handers import AuthToken, RedisAuthToken
 
 (
     HANDLE_MENU,
@@ -59,9 +83,9 @@ def start(update, context):
     chat = update.message
     chat.bot.delete_message(chat.chat_id, message_id=chat.message_id)
 
-    auth_token = context.bot_data['auth_token'].token
+    auth = context.bot_data['auth_token']
 
-    products = fetch_products(auth_token)
+    products = catalog.fetch_products(auth)
     send_products(products, chat)
 
     return HANDLE_MENU
@@ -75,18 +99,26 @@ def handle_menu(update, context):
     """
     query = update.callback_query.data
     chat = update.callback_query.message
-    chat.bot.delete_message(chat.chat_id, message_id=chat.message_id)
 
-    auth_token = context.bot_data['auth_token'].token
+    auth = context.bot_data['auth_token']
 
     if query == 'Cart':
-        cart = fetch_cart_items(auth_token, 'pizza_{}'.format(chat.chat_id))
+        cart = carts.get(auth.token, 'pizza_{}'.format(chat.chat_id))
         send_cart(cart, chat)
 
         return HANDLE_CART
 
-    product = fetch_product_by_id(auth_token, query)['data']
-    send_product_details(product, chat, auth_token)
+    product_response, image_url = run_coroutine(
+        fetch_product_with_image_url(auth, query)
+    )
+    photo_file_ids = context.bot_data.setdefault('photo_file_ids', {})
+    send_product_details(
+        product_response['data'],
+        chat,
+        auth,
+        photo_file_ids,
+        image_url=image_url,
+    )
 
     return HANDLE_DESCRIPTION
 
@@ -99,25 +131,24 @@ def handle_description(update, context):
     """
     query = update.callback_query.data
     chat = update.callback_query.message
-    chat.bot.delete_message(chat.chat_id, message_id=chat.message_id)
 
-    auth_token = context.bot_data['auth_token'].token
+    auth = context.bot_data['auth_token']
 
     if query == 'Back to menu':
-        products = fetch_products(auth_token)
+        products = catalog.fetch_products(auth)
         send_products(products, chat)
 
         return HANDLE_MENU
 
     if query == 'Cart':
-        cart = fetch_cart_items(auth_token, f'tg_pizza_{chat.chat_id}')
+        cart = carts.get(auth.token, 'pizza_{}'.format(chat.chat_id))
         send_cart(cart, chat)
 
         return HANDLE_CART
 
     product_id, quantity = query.split(';')
-    cart = add_product_to_cart(
-        auth_token,
+    cart = carts.add(
+        auth.token,
         'pizza_{}'.format(chat.chat_id),
         product_id,
         int(quantity),
@@ -136,23 +167,22 @@ def handle_cart(update, context):
     """
     query = update.callback_query.data
     chat = update.callback_query.message
-    chat.bot.delete_message(chat.chat_id, message_id=chat.message_id)
 
-    auth_token = context.bot_data['auth_token'].token
+    auth = context.bot_data['auth_token']
 
     if query == 'Back to menu':
-        products = fetch_products(auth_token)
+        products = catalog.fetch_products(auth)
         send_products(products, chat)
 
         return HANDLE_MENU
 
     if query == 'Pay':
-        chat.reply_text('Введите ваш email')
+        render_text(chat, 'Введите ваш email')
 
         return WAIT_EMAIL
 
-    cart = remove_cart_item_by_id(
-        auth_token,
+    cart = carts.remove(
+        auth.token,
         'pizza_{}'.format(chat.chat_id),
         query,
     )
@@ -212,8 +242,11 @@ def handle_address_or_location(update, context):
     if location := update.message.location:
         position = (location.latitude, location.longitude)
 
-    elif not (
-        position := fetch_coordinates(yandex_token, update.message.text)
+    elif None in (
+        position := fetch_coordinates_cached(
+            yandex_token,
+            update.message.text,
+        )
     ):
         update.message.reply_text(
             'Не получилось определить ваши координаты. '
@@ -222,7 +255,13 @@ def handle_address_or_location(update, context):
 
         return HANDLE_COORDINATES
 
-    nearest_pizzeria = find_nearest_pizzeria(auth_token, position)
+    nearest_pizzeria, _ = run_coroutine(
+        prepare_checkout(
+            auth_token,
+            'pizza_{}'.format(update.message.chat_id),
+            position,
+        )
+    )
     context.user_data['nearest_pizzeria'] = nearest_pizzeria
     send_delivery_options(nearest_pizzeria, update.message)
 
@@ -351,23 +390,25 @@ def exit(update, context):
     return ConversationHandler.END
 
 
-if __name__ == '__main__':
-    load_dotenv()
+def save_snapshot(context):
+    """Job saving catalog snapshot served while API is unavailable
 
-    bot_token = os.getenv('TG_PIZZA_BOT_TOKEN')
-    client_id = os.getenv('CLIENT_ID')
-    client_secret = os.getenv('CLIENT_SECRET')
+    Args:
+        context: job callback context
+    """
+    auth_token = context.bot_data['auth_token'].token
+    save_catalog_snapshot(auth_token, context.job.context)
 
-    persistence = PicklePersistence(filename='conversationbot')
-    updater = Updater(bot_token, use_context=True, persistence=persistence)
-    jq = updater.job_queue
 
-    dp = updater.dispatcher
-    dp.bot_data['yandex_token'] = os.getenv('YANDEX_API_TOKEN')
-    dp.bot_data['payment_token'] = os.getenv('PAYMENT_PROVIDER_TOKEN')
-    dp.bot_data['auth_token'] = AuthToken(client_id, client_secret)
+def create_conversation_handler():
+    """Create conversation handler with all bot states.
+
+    Every handler is measured in handler metrics.
 
-    handler = ConversationHandler(
+    Returns:
+        persistent conversation handler
+    """
+    conversation_handler = SyncedConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             HANDLE_MENU: [CallbackQueryHandler(handle_menu)],
@@ -398,8 +439,111 @@ if __name__ == '__main__':
         name='conversation_handler',
         per_chat=False,
     )
+    instrument_conversation(conversation_handler, bot='tg')
+
+    return conversation_handler
+
+
+def create_updater():
+    """Create updater configured from environment variables.
+
+    Returns:
+        updater with conversation handler registered
+    """
+    bot_token = os.getenv('TG_PIZZA_BOT_TOKEN')
+    client_id = os.getenv('CLIENT_ID')
+    client_secret = os.getenv('CLIENT_SECRET')
+
+    if redis_host := os.getenv('REDIS_HOST'):
+        db = Redis(
+            host=redis_host,
+            port=os.getenv('REDIS_PORT', 6379),
+            password=os.getenv('REDIS_PASSWORD', ''),
+        )
+        auth_token = RedisAuthToken(client_id, client_secret, db)
+        carts.db = db
+    else:
+        auth_token = AuthToken(client_id, client_secret)
+
+    moltin_pool_size = int(os.getenv('MOLTIN_POOL_SIZE', 10))
+    configure_client(
+        api_root=os.getenv('MOLTIN_API_ROOT', API_ROOT),
+        pool_size=moltin_pool_size,
+        token_provider=auth_token,
+    )
+    configure_async_client(pool_size=moltin_pool_size)
+
+    workers = int(os.getenv('TG_WORKERS', 8))
+    executor = KeyedExecutor(
+        max_workers=workers,
+        max_pending=int(os.getenv('TG_MAX_PENDING_UPDATES', 1000)),
+    )
+    senders = int(os.getenv('TG_SENDERS', 4))
+    configure_send_queue(
+        global_rate=float(os.getenv('TG_SEND_RATE', 30)),
+        chat_rate=float(os.getenv('TG_CHAT_SEND_RATE', 1)),
+        senders=senders,
+    )
+    bot = ExtBot(
+        bot_token,
+        base_url=os.getenv('TG_API_BASE_URL'),
+        request=Request(con_pool_size=workers + senders + 4),
+    )
+
+    persistence = create_persistence(
+        os.getenv('TG_PERSISTENCE_FILE', SQLITE_PERSISTENCE_FILE),
+        pickle_filename='conversationbot',
+        transient_bot_data_keys=['auth_token'],
+    )
+    job_queue = JobQueue()
+    dp = ConcurrentDispatcher(
+        bot,
+        Queue(),
+        job_queue=job_queue,
+        persistence=persistence,
+        executor=executor,
+    )
+    job_queue.set_dispatcher(dp)
 
-    dp.add_handler(handler)
+    updater = Updater(dispatcher=dp, workers=None)
 
-    updater.start_polling()
+    dp.bot_data['yandex_token'] = os.getenv('YANDEX_API_TOKEN')
+    dp.bot_data['payment_token'] = os.getenv('PAYMENT_PROVIDER_TOKEN')
+    dp.bot_data['auth_token'] = auth_token
+
+    dp.add_handler(create_conversation_handler())
+
+    snapshot_file = os.getenv('CATALOG_SNAPSHOT_FILE', CATALOG_SNAPSHOT_FILE)
+    load_and_seed_catalog(snapshot_file)
+    job_queue.run_repeating(
+        save_snapshot,
+        interval=int(os.getenv('CATALOG_SNAPSHOT_INTERVAL', 600)),
+        first=0,
+        context=snapshot_file,
+    )
+
+    return updater
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    updater = create_updater()
+
+    if metrics_port := os.getenv('METRICS_PORT'):
+        start_metrics_server(
+            int(metrics_port),
+            profiler_token=os.getenv('PROFILER_TOKEN'),
+        )
+
+    if webhook_url := os.getenv('TG_WEBHOOK_URL'):
+        url_path = os.getenv('TG_WEBHOOK_PATH', 'telegram')
+        updater.start_webhook(
+            listen='0.0.0.0',
+            port=int(os.getenv('TG_WEBHOOK_PORT', 8443)),
+            url_path=url_path,
+            webhook_url=f'{webhook_url}/{url_path}',
+        )
+    else:
+        updater.start_polling()
     updater.idle()
@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import wait
+
+from dotenv import load_dotenv
+from flask import Flask, Response, request
+from telegram import Update
+
+from helpers.carts import carts
+from helpers.metrics import CONTENT_TYPE, render_metrics
+from helpers.profiler import handle_profile_request
+from helpers.tg_dispatcher import (
+    USER_LOCKS_DIR,
+    FileKeyLocks,
+    SyncedConversationHandler,
+)
+from tg_bot import create_updater
+
+load_dotenv()
+
+updater = create_updater()
+dispatcher = updater.dispatcher
+updater.job_queue.start()
+
+if carts.db is None:
+    # carts mirrored in memory of a worker miss changes made by other ones
+    carts.memory_mirror = False
+
+conversation_handler = next(
+    handler
+    for handler in dispatcher.handlers[0]
+    if isinstance(handler, SyncedConversationHandler)
+)
+# other workers may have changed conversation state and may be handling
+# updates of the same user
+dispatcher.prepare_update = conversation_handler.reload_conversation
+dispatcher.key_locks = FileKeyLocks(
+    os.getenv('TG_USER_LOCKS_DIR', USER_LOCKS_DIR)
+)
+
+webhook_path = os.getenv('TG_WEBHOOK_PATH', 'telegram')
+
+app = Flask(__name__)
+
+
+@app.route(f'/{webhook_path}', methods=['POST'])
+def webhook():
+    """Webhook to handle telegram updates."""
+
+    update = Update.de_json(request.get_json(force=True), dispatcher.bot)
+    # replying after processing keeps updates of the user posted one after
+    # another in order, whichever workers receive them
+    if processing := dispatcher.process_update(update):
+        wait([processing])
+
+    return 'ok', 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metrics of all workers in Prometheus format."""
+
+    return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    """Hottest stacks of the worker sampled during requested time."""
+
+    status, text = handle_profile_request(
+        request.args.get('token'),
+        request.args.get('seconds'),
+        os.getenv('PROFILER_TOKEN'),
+    )
+
+    return Response(text, status=status, mimetype='text/plain')
+
+
+if __name__ == '__main__':
+    webhook_url = os.getenv('TG_WEBHOOK_URL')
+    dispatcher.bot.set_webhook(f'{webhook_url}/{webhook_path}')
+    updater.job_queue.stop()